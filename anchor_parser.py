@@ -0,0 +1,373 @@
+# html.parser based anchor parsers of link_standarizer, imported only once a text has an <a> tag: html.parser
+# takes longer to import than link_standarizer itself
+from collections import deque
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+
+# BeautifulSoup collapses strings made only of these to a single space or newline, except inside <pre> and <textarea>
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+_PRESERVE_WHITESPACE_TAGS = frozenset(('pre', 'textarea'))
+
+# Elements that never have content, html.parser doesn't see an end tag for them
+_VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                            'source', 'track', 'wbr'))
+
+
+class AnchorParser(HTMLParser):
+    """
+    Finds the first <a> tag and collects its attributes and content, filling the same 'Title', 'Url' and 'Class'
+    values BeautifulSoup would: 'Title' is the tag .string, 'Class' the list of classes.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.attributes = None
+        # (line, column) of the anchor start tag
+        self.position = None
+        # Content of the anchor as nested lists: strings are text, lists are child elements
+        self.children = []
+        # Open elements as (tag, children). Elements opened before the anchor have no children list, closing one
+        # of them closes the anchor too
+        self._open = []
+        # How many elements of every tag are open, so end tags that match none are dropped without a search
+        self._open_tags = {}
+        self._anchor_closed = False
+        # Text is merged into the previous string only until the next tag, like BeautifulSoup does
+        self._in_string = False
+
+    def handle_starttag(self, tag, attrs):
+        self._in_string = False
+
+        if self._anchor_closed:
+            return
+
+        if self.attributes is None:
+            if tag == 'a':
+                # Repeated attributes: last one wins, missing values are empty
+                self.attributes = {name: value or '' for name, value in attrs}
+                self.position = self.getpos()
+                self._push(tag, self.children)
+            elif tag not in _VOID_ELEMENTS:
+                self._push(tag, None)
+            return
+
+        element = []
+        self._open[-1][1].append(element)
+        if tag not in _VOID_ELEMENTS:
+            self._push(tag, element)
+
+    def _push(self, tag, children):
+        self._open.append((tag, children))
+        self._open_tags[tag] = self._open_tags.get(tag, 0) + 1
+
+    def handle_endtag(self, tag):
+        self._in_string = False
+
+        # Unmatched end tags are ignored
+        if self._anchor_closed or not self._open_tags.get(tag):
+            return
+
+        # Close up to the matching open element
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                if (self.attributes is not None and self._open[i][1] is None) or self._open[i][1] is self.children:
+                    self._anchor_closed = True
+                for closed, _ in self._open[i:]:
+                    self._open_tags[closed] -= 1
+                del self._open[i:]
+                break
+
+    def _anchor_content(self) -> Optional[list]:
+        if self._anchor_closed or self.attributes is None:
+            return None
+
+        return self._open[-1][1]
+
+    def handle_data(self, data):
+        children = self._anchor_content()
+        if children is None:
+            return
+
+        if self._in_string:
+            # Keeps the string type, see _PreservedString
+            children[-1] = type(children[-1])(children[-1] + data)
+        else:
+            children.append(_PreservedString(data) if self._preserves_whitespace() else data)
+            self._in_string = True
+
+    # Inside <pre> or <textarea>, where whitespace is kept as it is
+    def _preserves_whitespace(self) -> bool:
+        return any(tag in _PRESERVE_WHITESPACE_TAGS for tag, _ in self._open)
+
+    # Comments, declarations and processing instructions are strings of their own, never merged with text
+    def handle_comment(self, data):
+        self._append_special_string(data)
+
+    def handle_decl(self, decl):
+        self._append_special_string(decl)
+
+    def handle_pi(self, data):
+        self._append_special_string(data)
+
+    def unknown_decl(self, data):
+        if data.upper().startswith('CDATA['):
+            data = data[len('CDATA['):]
+        self._append_special_string(data)
+
+    def _append_special_string(self, data):
+        self._in_string = False
+
+        children = self._anchor_content()
+        if children is not None:
+            children.append(_SpecialString(data))
+
+    # Offset of the anchor in the source, its title, href and classes. None if there's no anchor
+    def anchor_parts(self, source: str) -> Optional[Tuple[int, Optional[str], Optional[str], Tuple[str, ...]]]:
+        if self.attributes is None:
+            return None
+
+        # html.parser counts lines from 1 and columns from 0
+        line, column = self.position
+        start = 0
+        for _ in range(line - 1):
+            start = source.index('\n', start) + 1
+        start += column
+
+        return start, _element_string(self.children), self.attributes.get('href'), tuple(
+            self.attributes.get('class', '').split())
+
+
+# Comment, declaration or processing instruction inside an anchor
+class _SpecialString(str):
+    pass
+
+
+# Text inside <pre> or <textarea>, never collapsed
+class _PreservedString(str):
+    pass
+
+
+# Same as BeautifulSoup .string: the text of an element whose only child is a string, or a single element child
+# with a .string itself
+def _element_string(children: list) -> Optional[str]:
+    # Down the single children, in a loop: anchors can be nested deeper than the recursion limit
+    while True:
+        if len(children) != 1:
+            return None
+
+        child = children[0]
+
+        if not isinstance(child, list):
+            break
+
+        children = child
+
+    if type(child) is str and not child.strip(_ASCII_SPACES):
+        return '\n' if '\n' in child else ' '
+
+    return str(child)
+
+
+# All the text of an element, comments left out, like BeautifulSoup get_text()
+def _element_text(children: list) -> str:
+    text = []
+    stack = [iter(children)]
+
+    while stack:
+        for child in stack[-1]:
+            if isinstance(child, list):
+                stack.append(iter(child))
+                break
+
+            if type(child) is not _SpecialString:
+                text.append(child)
+        else:
+            stack.pop()
+
+    return ''.join(text)
+
+
+class AnchorRewriter(AnchorParser):
+    """
+    Incremental html.parser pass that replaces every anchor of the text with a markdown link. Text around anchors
+    is copied from the source as it is, only what's still undecided (an open anchor, an incomplete tag) is kept.
+    """
+
+    def __init__(self, max_anchor_length: int):
+        super().__init__()
+        self.max_anchor_length = max_anchor_length
+        # Source text from offset self._text_start on that is not output yet
+        self._text = ''
+        self._text_start = 0
+        self._fed = 0
+        # Offset where every line starts, from line self._first_line on
+        self._line_starts = deque([0])
+        self._first_line = 1
+        # Offset of the open anchor
+        self._anchor_start = None
+        # <pre> and <textarea> open around the anchor
+        self._preserve_depth = 0
+        self._output = []
+
+    def feed(self, data):
+        newline = data.find('\n')
+        while newline >= 0:
+            self._line_starts.append(self._fed + newline + 1)
+            newline = data.find('\n', newline + 1)
+
+        self._text += data
+        self._fed += len(data)
+
+        try:
+            super().feed(data)
+        except AssertionError:
+            # html.parser gives up on malformed markup like '<![x'. Copy what's pending as it is and start over
+            self._start_over()
+            return
+
+        # Too long to be an anchor
+        if self._anchor_start is not None and self._fed - self._anchor_start > self.max_anchor_length:
+            self._abandon_anchor()
+
+        # html.parser holds back the text of an unclosed <script>, <style>, '<!--' or '<![CDATA[' until it's closed,
+        # parsing it all again on every feed. Past the same limit, copy it as it is and start over
+        if len(self.rawdata) > self.max_anchor_length:
+            self._start_over()
+            return
+
+        self._flush(self._anchor_start if self._anchor_start is not None else self._fed - len(self.rawdata))
+
+    # Copy data to the output as it is, without parsing it, i.e. code. An anchor open before it is given up on
+    def feed_verbatim(self, data):
+        self._start_over()
+        self._output.append(data)
+        self._fed += len(data)
+        self._text_start = self._fed
+        self._line_starts = deque([self._fed])
+
+    # Copy everything pending as it is and reset the parser, for input it can't make sense of
+    def _start_over(self):
+        self._abandon_anchor()
+        self._flush_all()
+        self.reset()
+        self._preserve_depth = 0
+        self._line_starts = deque([self._fed])
+        self._first_line = 1
+
+    def close(self):
+        try:
+            super().close()
+        except AssertionError:
+            pass
+
+        self._abandon_anchor()
+        self._flush_all()
+
+    # Complete lines of output, all of it when final
+    def pop_lines(self, final: bool = False) -> List[str]:
+        output = ''.join(self._output)
+
+        if not final:
+            end = output.rfind('\n') + 1
+            self._output = [output[end:]] if end < len(output) else []
+            output = output[:end]
+        else:
+            self._output = []
+
+        return output.splitlines(True)
+
+    def _offset(self, position: Tuple[int, int]) -> int:
+        line, column = position
+        return self._line_starts[line - self._first_line] + column
+
+    # Output the source text up to offset, forgetting the lines before it
+    def _flush(self, offset: int):
+        if offset <= self._text_start:
+            return
+
+        self._output.append(self._text[:offset - self._text_start])
+        self._text = self._text[offset - self._text_start:]
+        self._text_start = offset
+
+        while len(self._line_starts) > 1 and self._line_starts[1] <= offset:
+            self._line_starts.popleft()
+            self._first_line += 1
+
+    def _flush_all(self):
+        self._flush(self._fed)
+
+    def _preserves_whitespace(self) -> bool:
+        return self._preserve_depth > 0 or super()._preserves_whitespace()
+
+    def _abandon_anchor(self):
+        self.attributes = None
+        self.children = []
+        self._open = []
+        self._anchor_start = None
+
+    def handle_starttag(self, tag, attrs):
+        self._in_string = False
+
+        if self.attributes is None:
+            if tag == 'a':
+                self.attributes = {name: value or '' for name, value in attrs}
+                self.children = []
+                self._open = [(tag, self.children)]
+                self._anchor_start = self._offset(self.getpos())
+            elif tag in _PRESERVE_WHITESPACE_TAGS:
+                self._preserve_depth += 1
+            return
+
+        element = []
+        self._open[-1][1].append(element)
+        if tag not in _VOID_ELEMENTS:
+            self._open.append((tag, element))
+
+    def handle_endtag(self, tag):
+        self._in_string = False
+
+        if self.attributes is None:
+            if tag in _PRESERVE_WHITESPACE_TAGS and self._preserve_depth:
+                self._preserve_depth -= 1
+            return
+
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                del self._open[i:]
+                break
+
+        if self._open:
+            return
+
+        # Anchor closed: the end tag runs up to the next '>'
+        end_tag_start = self._offset(self.getpos())
+        end = self._text.index('>', end_tag_start - self._text_start) + 1 + self._text_start
+        mdlink = _anchor_to_mdlink(self.children, self.attributes)
+
+        if mdlink is not None:
+            self._flush(self._anchor_start)
+            self._output.append(mdlink)
+            self._text = self._text[end - self._text_start:]
+            self._text_start = end
+
+        self._abandon_anchor()
+
+
+# Markdown link for an anchor, or None if it has no href
+def _anchor_to_mdlink(children: list, attributes: dict) -> Optional[str]:
+    url = attributes.get('href')
+    if url is None:
+        return None
+
+    title = _element_string(children)
+    if title is None:
+        title = _element_text(children)
+
+    # One line title, brackets escaped. Url without the characters that would end the link
+    title = ' '.join(title.split())
+    title = title.replace('\\', '\\\\').replace('[', '\\[').replace(']', '\\]')
+    url = url.strip().replace(' ', '%20').replace('(', '%28').replace(')', '%29').replace('<', '%3C').replace(
+        '>', '%3E')
+
+    return '[' + title + '](' + url + ')'
@@ -0,0 +1,283 @@
+"""
+Benchmarks for link_standarizer on synthetic vaults.
+
+    python bench_link_standarizer.py --notes 500 --output bench.json
+    python bench_link_standarizer.py --notes 500 --compare bench.json
+
+Times link_type() and anylink_to_standarizedmdlink() per link, multiline_anylink_standarize() per note and per
+pathological line, and the whole vault run, and saves the results as JSON so revisions can be compared.
+"""
+import os
+import sys
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import timeit
+from typing import Dict, Optional
+
+import link_standarizer
+import vault_standarizer
+
+# Link types a synthetic vault is made of, and the mix used by default
+LINK_KINDS = ('wikilink', 'embeddedimage', 'internalmdlink', 'urlmdlink', 'ahreflink')
+DEFAULT_MIX = {
+    'wikilink': 4,
+    'embeddedimage': 2,
+    'internalmdlink': 2,
+    'urlmdlink': 1,
+    'ahreflink': 1
+}
+
+# Units repeated to build lines with many brackets and parens and few or no links, like minified tables or pasted
+# JSON. Backtracking regexes take super-linear time on them
+PATHOLOGICAL_UNITS = ('[a](', '[[', '[](/', '[x]', '![', '[[a]](', ']](', '[a](b ', '{"a": [1, (2)]}, ', '|[|](|')
+
+_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do', 'eiusmod',
+          'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua', 'note', 'daily', 'project')
+
+
+# A random link of the given kind
+def generate_link(rng: random.Random, kind: str) -> str:
+    name = ' '.join(rng.choice(_WORDS).capitalize() for _ in range(rng.randint(1, 3)))
+    folder = rng.choice(('', 'projects/', 'projects/2020/', '/attachments/'))
+
+    if kind == 'wikilink':
+        return '[[' + name + ']]'
+    elif kind == 'embeddedimage':
+        return '![](' + folder + name + '.png)'
+    elif kind == 'internalmdlink':
+        return '[' + name + '](' + folder + name.replace(' ', '%20') + '.md)'
+    elif kind == 'urlmdlink':
+        return '[' + name + '](https://example.com/' + name.replace(' ', '-').lower() + '.html)'
+    elif kind == 'ahreflink':
+        return "<a href='https://example.com/" + name.replace(' ', '-').lower() + "'>" + name + "</a>"
+    else:
+        raise ValueError(f"unknown link kind: {kind}")
+
+
+# A random note
+def generate_note(rng: random.Random, lines: int = 50, line_length: int = 80, link_density: float = 0.2,
+                  mix: Optional[Dict[str, int]] = None) -> str:
+    """
+    :int lines: Lines in the note
+    :int line_length: Average characters of prose per line
+    :float link_density: Average links per line
+    :dict mix: Relative weight of every link kind, DEFAULT_MIX if not given
+    """
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    note = []
+
+    for _ in range(lines):
+        words = []
+        length = 0
+        target = rng.randint(line_length // 2, line_length * 3 // 2)
+
+        while length < target:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+
+        # Poisson-like number of links, so density can go above 1 link per line
+        links = int(link_density) + (rng.random() < link_density - int(link_density))
+        for _ in range(links):
+            words.insert(rng.randint(0, len(words)), generate_link(rng, rng.choices(kinds, weights)[0]))
+
+        note.append(' '.join(words) + '\n')
+
+    return ''.join(note)
+
+
+# Lines made of every pathological unit repeated up to length chars
+def pathological_lines(length: int = 10000) -> list:
+    return [(unit * (length // len(unit) + 1))[:length] + '\n' for unit in PATHOLOGICAL_UNITS]
+
+
+# Write a random vault of notes to path
+def generate_vault(path: str, notes: int = 100, folders: int = 5, seed: int = 0, **note_options) -> list:
+    """
+    :int notes: Notes in the vault
+    :int folders: Notes are spread over this many folders
+    :int seed: Same seed, same vault
+    :note_options: Passed on to generate_note()
+
+    :return: returns the paths of the notes
+    """
+    rng = random.Random(seed)
+    paths = []
+
+    for i in range(notes):
+        folder = os.path.join(path, f'folder{i % folders}') if folders else path
+        os.makedirs(folder, exist_ok=True)
+        note_path = os.path.join(folder, f'note{i}.md')
+
+        with open(note_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(generate_note(rng, **note_options))
+
+        paths.append(note_path)
+
+    return paths
+
+
+# Best time of a few runs, in seconds per call
+def _best_time(function, repeat: int) -> float:
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat, number)) / number
+
+
+# Run every benchmark and return the results
+def run_benchmarks(notes: int = 100, lines: int = 50, line_length: int = 80, link_density: float = 0.2,
+                   mix: Optional[Dict[str, int]] = None, seed: int = 0, repeat: int = 5) -> dict:
+    """
+    :return: returns {'parameters': ..., 'environment': ..., 'results': {benchmark: seconds per item}}. Per link
+             benchmarks are named after the function and link kind, i.e. 'link_type/wikilink'
+    """
+    rng = random.Random(seed)
+    results = {}
+
+    # Per link
+    for kind in LINK_KINDS:
+        links = [generate_link(rng, kind) for _ in range(100)]
+
+        for function in (link_standarizer.link_type, link_standarizer.anylink_to_standarizedmdlink):
+            seconds = _best_time(lambda: [function(link) for link in links], repeat)
+            results[f'{function.__name__}/{kind}'] = seconds / len(links)
+
+    # Per file
+    note_options = {'lines': lines, 'line_length': line_length, 'link_density': link_density, 'mix': mix}
+    note = generate_note(rng, **note_options)
+    results['multiline_anylink_standarize/note'] = _best_time(
+        lambda: link_standarizer.multiline_anylink_standarize(note), repeat)
+
+    # Per pathological line, all of them
+    lines = pathological_lines()
+    results['multiline_anylink_standarize/pathological'] = _best_time(
+        lambda: [link_standarizer.multiline_anylink_standarize(ln) for ln in lines], repeat) / len(lines)
+
+    # Per vault, in this process so it's not measuring the pool start up
+    tmp = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp, 'source')
+        generate_vault(source, notes, seed=seed, **note_options)
+
+        times = []
+        for i in range(repeat):
+            vault = os.path.join(tmp, f'vault{i}')
+            shutil.copytree(source, vault)
+
+            start = time.perf_counter()
+            vault_standarizer.standarize_vault(vault, workers=1)
+            times.append(time.perf_counter() - start)
+
+        results['standarize_vault/vault'] = min(times)
+    finally:
+        shutil.rmtree(tmp)
+
+    return {
+        'parameters': {
+            'notes': notes,
+            'lines': lines,
+            'line_length': line_length,
+            'link_density': link_density,
+            'mix': mix or DEFAULT_MIX,
+            'seed': seed,
+            'repeat': repeat
+        },
+        'environment': {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+
+
+# Current git commit, if running from a checkout
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Compare two benchmark runs
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> Dict[str, float]:
+    """
+    :float threshold: Slowdown that counts as a regression, 0.1 is 10% slower
+
+    :return: returns {benchmark: current / baseline time} for the benchmarks that regressed
+    """
+    regressions = {}
+
+    for name, seconds in current['results'].items():
+        baseline_seconds = baseline['results'].get(name)
+
+        if baseline_seconds and seconds / baseline_seconds > 1 + threshold:
+            regressions[name] = seconds / baseline_seconds
+
+    return regressions
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark link_standarizer on a synthetic vault.')
+    parser.add_argument('--notes', type=int, default=100, help='notes in the vault (default: 100)')
+    parser.add_argument('--lines', type=int, default=50, help='lines per note (default: 50)')
+    parser.add_argument('--line-length', type=int, default=80, help='average line length (default: 80)')
+    parser.add_argument('--link-density', type=float, default=0.2, help='average links per line (default: 0.2)')
+    parser.add_argument('--mix', default=None,
+                        help='link kind weights, i.e. wikilink=4,urlmdlink=1 (default: ' +
+                             ','.join(f'{kind}={weight}' for kind, weight in DEFAULT_MIX.items()) + ')')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per benchmark, the best one counts')
+    parser.add_argument('-o', '--output', help='save the results as JSON')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown that fails --compare (default: 0.1, 10%%)')
+    args = parser.parse_args(argv)
+
+    mix = None
+    if args.mix:
+        mix = {kind: int(weight) for kind, weight in (item.split('=') for item in args.mix.split(','))}
+
+    report = run_benchmarks(args.notes, args.lines, args.line_length, args.link_density, mix, args.seed,
+                            args.repeat)
+
+    for name, seconds in report['results'].items():
+        print(f'{name:50} {_format_seconds(seconds):>12}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+
+        for name, ratio in regressions.items():
+            print(f'REGRESSION {name}: {ratio:.2f}x slower', file=sys.stderr)
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
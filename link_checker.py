@@ -0,0 +1,133 @@
+import os
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import link_index
+import link_standarizer
+import vault_standarizer
+from link_index import IndexedLink
+
+
+class LinkChecker:
+    """
+    Finds the links of a vault that point to files that don't exist.
+
+    Wikilinks are looked up by name in a FilenameIndex of the vault. Path links (internal and standardized mdlinks)
+    are deduplicated across the vault, so every target is looked up once however many notes link to it: first in the
+    file index, then with os.stat() for targets out of it (outside the vault, in hidden folders, folders). stat()
+    results are kept in a cache shared by the threads, and by later checks until clear_cache(). Notes are read and
+    targets stat'ed on a thread pool, network mounted vaults spend most of the time waiting on I/O.
+
+    Url links are not checked.
+    """
+
+    def __init__(self, vault: str, workers: Optional[int] = None,
+                 filename_index: Optional[link_index.FilenameIndex] = None):
+        """
+        :string vault: Directory with the markdown notes
+        :int workers: Threads reading notes and stat'ing targets, ThreadPoolExecutor's default if not given
+        :FilenameIndex filename_index: Index of the vault file names, built here if not given
+        """
+        self.vault = os.path.abspath(vault)
+        self.workers = workers
+        self.filename_index = filename_index or link_index.FilenameIndex(self.vault)
+        # Vault relative path -> it exists
+        self._stat_cache: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        # Notes the last check() couldn't read or decode, vault relative path -> error
+        self.errors: Dict[str, str] = {}
+
+    # Links whose target doesn't exist, sorted by note, line and position
+    def check(self, paths: Optional[Iterable[str]] = None) -> List[IndexedLink]:
+        """
+        :iterable paths: Notes to check, every markdown file in the vault by default
+
+        :return: returns the broken links. Targets are normalized like link_index.normalize_target() does
+        """
+        if paths is None:
+            paths = vault_standarizer.iter_markdown_files(self.vault)
+
+        broken = []
+        self.errors = {}
+        # Normalized target -> links pointing to it
+        path_links: Dict[str, List[IndexedLink]] = {}
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            for links in pool.map(self._note_links, paths):
+                for link in links:
+                    if link.link_type == 'wikilink':
+                        if not self.filename_index.find(link.target):
+                            broken.append(link)
+                    else:
+                        path_links.setdefault(link.target, []).append(link)
+
+            targets = list(path_links)
+            for target, exists in zip(targets, pool.map(self.exists, targets)):
+                if not exists:
+                    broken.extend(path_links[target])
+
+        return sorted(broken)
+
+    # Whether a vault relative path exists, from the file index or the stat cache
+    def exists(self, target: str) -> bool:
+        if target in self.filename_index:
+            return True
+
+        with self._lock:
+            exists = self._stat_cache.get(target)
+
+        if exists is None:
+            exists = os.path.exists(os.path.join(self.vault, target))
+
+            with self._lock:
+                self._stat_cache[target] = exists
+
+        return exists
+
+    # Forget the stat() results, i.e. after files were added or removed
+    def clear_cache(self):
+        with self._lock:
+            self._stat_cache.clear()
+
+    # Links of a note that point to a file, with their normalized targets
+    def _note_links(self, path: str) -> List[IndexedLink]:
+        relpath = os.path.relpath(path, self.vault).replace(os.sep, '/')
+
+        # A note that can't be read is reported in errors, the rest are still checked
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self.errors[relpath] = str(e)
+            return []
+
+        links = []
+        for line, start, end, record in link_standarizer.iter_links(text):
+            if _local_target(record):
+                links.append(IndexedLink(relpath, line, start, end, record.link_type,
+                                         link_index.normalize_target(record, relpath)))
+
+        return links
+
+
+# Target of a link in the vault, without its '#heading' and '|alias'. Empty for urls and links within the same note
+def _local_target(record) -> str:
+    if record.link_type == 'urlmdlink':
+        return ''
+
+    if record.link_type == 'wikilink':
+        return record.target.split('|', 1)[0].split('#', 1)[0].strip()
+
+    return link_standarizer._unquote((record.path + record.filename).split('#', 1)[0])
+
+
+# Check every note of a vault, see LinkChecker
+def check_vault(vault: str, workers: Optional[int] = None) -> List[IndexedLink]:
+    return LinkChecker(vault, workers).check()
+
+
+# One line report of a broken link: 'note.md:12:5: wikilink Missing Note.md'. Columns start at 1
+def format_broken_link(link: IndexedLink) -> str:
+    return f"{link.source}:{link.line}:{link.start + 1}: {link.link_type} {link.target}"
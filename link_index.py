@@ -0,0 +1,625 @@
+import os
+import posixpath
+
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import link_standarizer
+import vault_standarizer
+
+# The index is kept here, inside the vault. Hidden, so it's never walked as a note
+INDEX_FILENAME = '.link_index.sqlite'
+
+# Bump when the tables change
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL);
+    CREATE TABLE IF NOT EXISTS links (
+        source TEXT NOT NULL,
+        line INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL,
+        link_type TEXT NOT NULL,
+        target TEXT NOT NULL,
+        target_name TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS links_source ON links (source);
+    CREATE INDEX IF NOT EXISTS links_target ON links (target);
+    CREATE INDEX IF NOT EXISTS links_target_name ON links (target_name);
+"""
+
+
+# A link as stored in the index. Paths are relative to the vault with '/' separators, line numbers start at 1 and
+# start/end are the link span in the line
+class IndexedLink(NamedTuple):
+    source: str
+    line: int
+    start: int
+    end: int
+    link_type: str
+    target: str
+
+
+# Normalized target of a link found in source, a vault relative path
+def normalize_target(record, source: str) -> str:
+    """
+    Where the link points to, so links written in different ways to the same note compare equal.
+
+    - **'wikilink'**: the note name, with '.md' added when it has no extension, like wikilink_to_mdlink() does
+    - **'internalmdlink'** and **'standardizedmdlink'**: url decoded path relative to the vault. Paths starting with '/'
+      are relative to the vault root, the rest to the folder of source. '#heading' anchors are dropped
+    - **'urlmdlink'**: the url as it is
+
+    :string source: Vault relative path of the note the link is in
+
+    :return: returns the normalized target
+    """
+    if record.link_type == 'wikilink':
+        target = record.target.split('|', 1)[0].split('#', 1)[0]
+
+        if not link_standarizer._has_extension(target):
+            target += '.md'
+
+        return target
+
+    if record.link_type == 'urlmdlink':
+        return record.url
+
+    target = link_standarizer._unquote((record.path + record.filename).split('#', 1)[0])
+
+    if target.startswith('/'):
+        return posixpath.normpath(target).lstrip('/')
+
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source), target))
+
+
+# Name a target is matched by, for wikilinks that only have the note name
+def _target_name(target: str) -> str:
+    return posixpath.basename(target).casefold()
+
+
+class LinkIndex:
+    """
+    On-disk index of every link in a vault: source note, line, span, link type and normalized target. Answers
+    forward link and backlink queries from SQLite indexes, and is kept up to date file by file.
+
+    Use update() to bring the whole vault up to date, update_file() and remove_file() when you know which note
+    changed.
+    """
+
+    def __init__(self, vault: str, index_path: Optional[str] = None):
+        self.vault = os.path.abspath(vault)
+        self.index_path = index_path or os.path.join(vault, INDEX_FILENAME)
+        self._db = sqlite3.connect(self.index_path)
+        self._db.executescript(_SCHEMA)
+        self._check_version()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    # Index built with other rules or tables is dropped, it's rebuilt by the next update()
+    def _check_version(self):
+        version = f"{_SCHEMA_VERSION}:{vault_standarizer.rules_version()}"
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+
+        if row is None or row[0] != version:
+            with self._db:
+                self._db.execute("DELETE FROM links")
+                self._db.execute("DELETE FROM files")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+
+    # Vault relative path with '/' separators. Relative paths are taken as relative to the vault already
+    def _relpath(self, path: str) -> str:
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.vault)
+
+        return path.replace(os.sep, '/')
+
+    # Bring the index up to date with the vault: new and changed notes are indexed, deleted ones removed
+    def update(self) -> Tuple[int, int]:
+        """
+        Reindex the notes whose size or mtime changed since they were indexed, and forget the deleted ones.
+
+        :return: returns (notes indexed, notes removed)
+        """
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self._db.execute(
+            "SELECT path, size, mtime_ns FROM files")}
+        indexed = 0
+
+        with self._db:
+            for path in vault_standarizer.iter_markdown_files(self.vault):
+                relpath = self._relpath(path)
+                st = os.stat(path)
+
+                if known.pop(relpath, None) != (st.st_size, st.st_mtime_ns):
+                    self._index_file(path, relpath, st)
+                    indexed += 1
+
+            for relpath in known:
+                self._forget(relpath)
+
+        return indexed, len(known)
+
+    # Reindex one note, i.e. after it was saved
+    def update_file(self, path: str):
+        relpath = self._relpath(path)
+        path = os.path.join(self.vault, relpath)
+
+        with self._db:
+            if os.path.exists(path):
+                self._index_file(path, relpath, os.stat(path))
+            else:
+                self._forget(relpath)
+
+    # Forget one note, i.e. after it was deleted
+    def remove_file(self, path: str):
+        with self._db:
+            self._forget(self._relpath(path))
+
+    def _forget(self, relpath: str):
+        self._db.execute("DELETE FROM links WHERE source = ?", (relpath,))
+        self._db.execute("DELETE FROM files WHERE path = ?", (relpath,))
+
+    def _index_file(self, path: str, relpath: str, st: os.stat_result):
+        # Lines are split like multiline_anylink_standarize() does, so line numbers and spans match its output
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                rows = list(_link_rows(relpath, f.read()))
+        except UnicodeDecodeError:
+            # Not UTF-8: indexed without links, so it's not read again until it changes
+            rows = []
+        except OSError:
+            # Gone or unreadable since it was listed
+            self._forget(relpath)
+            return
+
+        self._db.execute("DELETE FROM links WHERE source = ?", (relpath,))
+        self._db.executemany("INSERT INTO links VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._db.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                         (relpath, st.st_size, st.st_mtime_ns))
+
+    # Links found in a note
+    def links_from(self, source: str) -> List[IndexedLink]:
+        return self._query("WHERE source = ? ORDER BY line, start", (self._relpath(source),))
+
+    # Links pointing to a note. Wikilinks only have the note name, they match any note with that name
+    def backlinks(self, target: str) -> List[IndexedLink]:
+        target = self._relpath(target)
+
+        return self._query("WHERE target = ? OR (link_type = 'wikilink' AND target_name = ?) "
+                           "ORDER BY source, line, start", (target, _target_name(target)))
+
+    # Move a note and rewrite the links to it, in the notes that have one
+    def rename(self, old: str, new: str, filename_index: Optional['FilenameIndex'] = None) -> Dict[str, int]:
+        """
+        Rename or move the note old to new, and rewrite the links pointing to it. Only the notes backlinks() finds
+        are read and written, and only the spans of those links change. Links keep their format: wikilinks get the
+        new name, the links wikilink_to_mdlink() and internal_mdlink_to_standarizedinternal_mdlink() built are built
+        again for the new name and path, and internal mdlinks get the new path. Relative paths in the moved note
+        itself are made relative to its new folder.
+
+        Wikilinks match notes by name, so they are only rewritten when they resolve to old, see
+        FilenameIndex.resolve(). Notes with links to it that changed since they were indexed are indexed again
+        first, update() beforehand catches the links added since.
+
+        :string old: Vault relative or absolute path of the note
+        :string new: Where to move it. Missing folders are created
+        :FilenameIndex filename_index: Index of the vault file names wikilinks are resolved with, built here if not
+                                       given. The move is recorded in it
+
+        :return: returns {vault relative path of every note written: links rewritten}
+        """
+        old_rel, new_rel = self._relpath(old), self._relpath(new)
+        old_path, new_path = os.path.join(self.vault, old_rel), os.path.join(self.vault, new_rel)
+
+        if not os.path.isfile(old_path):
+            raise FileNotFoundError(f"No such note: {old_rel}")
+        if os.path.exists(new_path):
+            raise FileExistsError(f"Already exists: {new_rel}")
+
+        if filename_index is None:
+            filename_index = FilenameIndex(self.vault)
+
+        # The spans must be those of the notes as they are now
+        self._update_stale([old_rel] + [link.source for link in self._rename_candidates(old_rel)])
+
+        links: Dict[str, List[IndexedLink]] = {}
+        for link in self._rename_candidates(old_rel):
+            links.setdefault(link.source, []).append(link)
+
+        # Links of the moved note with paths relative to the folder it leaves
+        if posixpath.dirname(old_rel) != posixpath.dirname(new_rel):
+            moved_links = set(links.get(old_rel, ()))
+            for link in self.links_from(old_rel):
+                if link.link_type != 'urlmdlink' and link not in moved_links:
+                    links.setdefault(old_rel, []).append(link)
+
+        renamer = _LinkRenamer(old_rel, new_rel, filename_index)
+        written = {}
+
+        # The moved note is rewritten where it is, then moved
+        if old_rel in links:
+            self._rewrite_links(renamer, old_rel, new_rel, links.pop(old_rel), written)
+
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.rename(old_path, new_path)
+
+        # Wikilinks are resolved as they were before the move
+        for source in sorted(links):
+            self._rewrite_links(renamer, source, source, links[source], written)
+
+        filename_index.remove(old_rel)
+        filename_index.add(new_rel)
+
+        with self._db:
+            self._forget(old_rel)
+            for relpath in dict.fromkeys([new_rel] + list(written)):
+                path = os.path.join(self.vault, relpath)
+                self._index_file(path, relpath, os.stat(path))
+
+        return written
+
+    # Rewrite the links of a note to the moved one, recording it in written if any changed
+    def _rewrite_links(self, renamer: '_LinkRenamer', source: str, new_source: str, links: List[IndexedLink],
+                       written: Dict[str, int]):
+        path = os.path.join(self.vault, source)
+        with open(path, encoding='utf-8', newline='') as f:
+            text = f.read()
+
+        text, rewritten = renamer.rewrite(text, source, new_source, links)
+
+        if rewritten:
+            vault_standarizer.write_atomic(path, text.encode('utf-8'))
+            written[new_source] = rewritten
+
+    # Backlinks of a note, and the links built by wikilink_to_mdlink() that may point to it by name
+    def _rename_candidates(self, target: str) -> List[IndexedLink]:
+        return self._query("WHERE target = ? OR (link_type IN ('wikilink', 'standardizedmdlink') AND target_name = ?) "
+                           "ORDER BY source, line, start", (target, _target_name(target)))
+
+    # Index again the notes that changed since they were indexed
+    def _update_stale(self, relpaths: Iterable[str]):
+        for relpath in set(relpaths):
+            row = self._db.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (relpath,)).fetchone()
+            try:
+                st = os.stat(os.path.join(self.vault, relpath))
+            except OSError:
+                st = None
+
+            if row is None or st is None or tuple(row) != (st.st_size, st.st_mtime_ns):
+                self.update_file(relpath)
+
+    # Notes in the index
+    def files(self) -> List[str]:
+        return [path for path, in self._db.execute("SELECT path FROM files ORDER BY path")]
+
+    def _query(self, where: str, parameters: tuple) -> List[IndexedLink]:
+        return [IndexedLink(*row) for row in self._db.execute(
+            "SELECT source, line, start, end, link_type, target FROM links " + where, parameters)]
+
+
+class _LinkRenamer:
+    """
+    Rewrites the links to a note that is moved from old to new, see LinkIndex.rename().
+    """
+
+    def __init__(self, old: str, new: str, filename_index: 'FilenameIndex'):
+        self.old = old
+        self.new = new
+        self.filename_index = filename_index
+
+    # Rewrite the indexed links of a note, which will be at new_source. Returns the text and the links rewritten
+    def rewrite(self, text: str, source: str, new_source: str, links: List[IndexedLink]) -> Tuple[str, int]:
+        lines = text.splitlines(True)
+        rewritten = 0
+
+        # From the end of every line, so the spans before stay valid
+        for link in sorted(links, key=lambda link: (link.line, link.start), reverse=True):
+            ln = lines[link.line - 1]
+            record = link_standarizer.parse_link(ln[link.start:link.end])
+            if not record or record.link_type != link.link_type:
+                continue
+
+            replacement = self._rewrite_link(record, source, new_source)
+            if replacement is not None and replacement != ln[link.start:link.end]:
+                lines[link.line - 1] = ln[:link.start] + replacement + ln[link.end:]
+                rewritten += 1
+
+        return ''.join(lines), rewritten
+
+    # The link rewritten, or None if it doesn't point to the moved note or needs no change
+    def _rewrite_link(self, record, source: str, new_source: str) -> Optional[str]:
+        link = record.source
+
+        if record.link_type == 'wikilink':
+            if not self._resolves_to_old(record.target, source):
+                return None
+
+            return link[:record.start + 2] + self._new_wikilink_target(record.target) + link[record.end - 2:]
+
+        path = record.path + record.filename
+        points_to_old = normalize_target(record, source) == self.old
+
+        # Title of a link built by wikilink_to_mdlink() or internal_mdlink_to_standarizedinternal_mdlink()
+        title = record.title
+        wikilink_target = None
+        if record.link_type == 'standardizedmdlink' and title[:1] == '[' and title[-1:] == ']' and (
+                ']' not in title[1:-1]):
+            wikilink_target = title[1:-1]
+
+        if wikilink_target is not None and self._resolves_to_old(wikilink_target, source):
+            new_target = self._new_wikilink_target(wikilink_target)
+
+            if path == _wikilink_path(wikilink_target):
+                # Bare name, like wikilink_to_mdlink() without a resolver does
+                new_path = _wikilink_path(new_target)
+            elif points_to_old:
+                new_path = self._new_path(path, self.new, new_source)
+            else:
+                new_path = path
+
+            return (link[:record.title_start] + '[' + new_target + ']' + link[record.title_end:record.path_start] +
+                    new_path + link[record.filename_end:])
+
+        if points_to_old:
+            target = self.new
+        elif source != new_source and not path.startswith('/') and (
+                wikilink_target is None or path != _wikilink_path(wikilink_target)):
+            # A link of the moved note itself, to the same target from the new folder
+            target = normalize_target(record, source)
+        else:
+            return None
+
+        return link[:record.path_start] + self._new_path(path, target, new_source) + link[record.filename_end:]
+
+    # Whether a wikilink target resolves to the moved note from source
+    def _resolves_to_old(self, target: str, source: str) -> bool:
+        name = target.split('|', 1)[0].split('#', 1)[0]
+        resolved = self.filename_index.resolve(name, source)
+
+        return resolved is not None and posixpath.normpath(
+            posixpath.join(posixpath.dirname(source), resolved)) == self.old
+
+    # Wikilink target with the new name, alias and heading kept. Names with a path get the new path, so do names that
+    # other files share
+    def _new_wikilink_target(self, target: str) -> str:
+        end = len(target)
+        for separator in '|#':
+            if separator in target:
+                end = min(end, target.index(separator))
+        name = target[:end]
+
+        new_name = posixpath.basename(self.new)
+        if '/' in name.strip() or [path for path in self.filename_index.find(new_name) if path != self.old]:
+            new_name = self.new
+
+        # Without '.md', if the name didn't have it
+        if not link_standarizer._has_extension(name) and new_name.lower().endswith('.md'):
+            new_name = new_name[:-len('.md')]
+
+        return new_name + target[end:]
+
+    # Url encoded path to target from a note at new_source, vault rooted if path was. '#heading' anchors are kept
+    @staticmethod
+    def _new_path(path: str, target: str, new_source: str) -> str:
+        anchor = path[path.index('#'):] if '#' in path else ''
+
+        if path.startswith('/'):
+            return link_standarizer._quote('/' + target) + anchor
+
+        return link_standarizer._quote(posixpath.relpath(target, posixpath.dirname(new_source) or '.')) + anchor
+
+
+# Path wikilink_to_mdlink() links a wikilink target to without a resolver
+def _wikilink_path(target: str) -> str:
+    return link_standarizer._quote(target if link_standarizer._has_extension(target) else target + '.md')
+
+
+# Index rows for the links of a note
+def _link_rows(relpath: str, text: str) -> Iterable[tuple]:
+    for line, start, end, record in link_standarizer.iter_links(text):
+        target = normalize_target(record, relpath)
+        yield relpath, line, start, end, record.link_type, target, _target_name(target)
+
+
+# Every file of a vault, notes and attachments, as vault relative paths. Hidden folders are skipped, like
+# vault_standarizer.iter_markdown_files() does
+def iter_vault_files(vault: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(vault):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        reldir = os.path.relpath(dirpath, vault).replace(os.sep, '/')
+
+        for filename in sorted(filenames):
+            if not filename.startswith('.'):
+                yield filename if reldir == '.' else reldir + '/' + filename
+
+
+# Key of the trie nodes that holds the paths ending there
+_TRIE_PATHS = '\0'
+
+
+class FilenameIndex:
+    """
+    In-memory index of the file names of a vault, to resolve wikilinks to the note or attachment they point to with
+    dictionary lookups instead of searching the filesystem for every link.
+
+    Names are matched case-insensitively, by vault relative path or by file name alone, with '.md' added when they
+    have no extension. With partial=True, a prefix trie of file names also resolves unambiguous partial names.
+    """
+
+    def __init__(self, vault: str, partial: bool = False):
+        self.vault = os.path.abspath(vault)
+        self.partial = partial
+        # casefolded vault relative path -> path
+        self._paths: Dict[str, str] = {}
+        # casefolded file name -> paths with that name
+        self._names: Dict[str, Set[str]] = {}
+        self._trie: Optional[dict] = {} if partial else None
+
+        for path in iter_vault_files(self.vault):
+            self.add(path)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, path: str):
+        return path.casefold() in self._paths
+
+    # Index a new file, by vault relative path
+    def add(self, path: str):
+        key = path.casefold()
+        if key in self._paths:
+            return
+
+        self._paths[key] = path
+        name = posixpath.basename(key)
+        self._names.setdefault(name, set()).add(path)
+
+        if self._trie is not None:
+            node = self._trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node.setdefault(_TRIE_PATHS, set()).add(path)
+
+    # Forget a file, by vault relative path
+    def remove(self, path: str):
+        path = self._paths.pop(path.casefold(), None)
+        if path is None:
+            return
+
+        name = posixpath.basename(path.casefold())
+        self._names[name].discard(path)
+        if not self._names[name]:
+            del self._names[name]
+
+        if self._trie is not None:
+            node = self._trie
+            for char in name:
+                node = node[char]
+            node[_TRIE_PATHS].discard(path)
+
+    # Catch up with files added and removed since the index was built. Only directory listings are read
+    def refresh(self) -> Tuple[int, int]:
+        """
+        :return: returns (files added, files removed)
+        """
+        current = set(iter_vault_files(self.vault))
+        known = set(self._paths.values())
+
+        for path in current - known:
+            self.add(path)
+
+        for path in known - current:
+            self.remove(path)
+
+        return len(current - known), len(known - current)
+
+    # Files whose name starts with prefix, case-insensitively. Needs partial=True
+    def complete(self, prefix: str) -> List[str]:
+        if self._trie is None:
+            raise ValueError("complete() needs a FilenameIndex built with partial=True")
+
+        node = self._trie
+        for char in prefix.casefold():
+            node = node.get(char)
+            if node is None:
+                return []
+
+        paths = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for char, child in node.items():
+                if char == _TRIE_PATHS:
+                    paths.extend(child)
+                else:
+                    stack.append(child)
+
+        return sorted(paths)
+
+    # Resolve a wikilink target to the file it points to
+    def resolve(self, target: str, source: Optional[str] = None) -> Optional[str]:
+        """
+        :string target: Wikilink target, i.e. 'Some Note', 'projects/Some Note', 'image.png' or 'Some Note|alias'
+        :string source: Vault relative path of the note the link is in. When given, the path is returned relative to
+                        its folder and files in that same folder win over other files with the same name
+
+        :return: returns the path of the file, or None if there is none, the name is ambiguous or it has a
+                 '#heading' (so wikilink_to_mdlink() falls back to the bare name)
+        """
+        name = target.split('|', 1)[0].strip()
+        if '#' in name or not name:
+            return None
+
+        candidates = self._candidates(_name_keys(name))
+
+        if not candidates and self._trie is not None:
+            candidates = self.complete(posixpath.basename(name))
+            if len(candidates) != 1:
+                return None
+
+        if not candidates:
+            return None
+
+        folder = posixpath.dirname(source) if source is not None else None
+        path = min(candidates, key=lambda path: (posixpath.dirname(path) != folder, path.count('/'), path))
+
+        if folder is None:
+            return path
+
+        return posixpath.relpath(path, folder or '.')
+
+    # Every file a wikilink target can point to, '#heading' and '|alias' left aside. Empty if there is none
+    def find(self, target: str) -> List[str]:
+        name = target.split('|', 1)[0].split('#', 1)[0].strip()
+        if not name:
+            return []
+
+        return sorted(self._candidates(_name_keys(name)))
+
+    def _candidates(self, keys: List[str]) -> List[str]:
+        for key in keys:
+            if '/' in key:
+                # Vault relative path, or the end of one
+                path = self._paths.get(key.lstrip('/'))
+                if path is not None:
+                    return [path]
+
+                paths = [path for path in self._names.get(posixpath.basename(key), ())
+                         if path.casefold().endswith('/' + key)]
+            else:
+                paths = list(self._names.get(key, ()))
+
+            if paths:
+                return paths
+
+        return []
+
+    # Resolver for wikilink_to_mdlink() and the multiline functions, for links in the source note
+    def resolver(self, source: Optional[str] = None):
+        """
+        :string source: Vault relative or absolute path of the note being standarized. Paths are made relative to it
+
+        :return: returns a function from wikilink target to path
+        """
+        if source is not None and os.path.isabs(source):
+            source = os.path.relpath(source, self.vault).replace(os.sep, '/')
+
+        return lambda target: self.resolve(target, source)
+
+
+# Index keys a wikilink name matches, casefolded: with '.md' added first when it has no extension
+def _name_keys(name: str) -> List[str]:
+    keys = [name.casefold()]
+    if not link_standarizer._has_extension(name):
+        keys.insert(0, keys[0] + '.md')
+
+    return keys
@@ -1,26 +1,624 @@
-import urllib
-from urllib import parse
-
+import os
 import re
-from bs4 import BeautifulSoup
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
 
 # Most functions return str or False
-from typing import Union
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+
+# Links are found and split by hand written scanners (_iter_link_spans(), _parse_mdlink(), _find_wikilink()) instead
+# of backtracking regexes, so the time they take grows linearly with the line however many brackets and parens it
+# has. They match exactly what these regexes did:
+#
+#   standarizable links in a line   (!?\[{1,2}[^]]*?]{1,2}\(.*?\)|!?\[{2}.*?]{2}(?!\())
+#   whole mdlink                    ^(!)?\[(.*)]\((.*/)?(.*)\)$     embedded, title, path and filename
+#   wikilink anywhere               \[\[(.*?)]]
+
+# Same test urllib.parse.urlparse() does to detect a scheme, without building the whole ParseResult:
+# leading C0 controls and spaces are stripped, tabs and newlines are ignored, first char must be an ASCII letter
+_URL_SCHEME_REGEX = re.compile(r'[\x00-\x20]*[A-Za-z][A-Za-z0-9+.\-\t\r\n]*:')
+
+# Seconds a single line can take to standarize, see set_line_time_budget()
+_line_time_budget = 1.0
+
+# Opening or closing code fence, from the first non-blank char of the line: 3 or more backticks or tildes and the
+# info string
+_CODE_FENCE_REGEX = re.compile(r'(`{3,}|~{3,})(.*)')
+
+# List item marker: bullet or ordered, i.e. '- ', '* ', '1. ', '2) '
+_LIST_ITEM_REGEX = re.compile(r'[ \t]*(?:[-+*]|\d{1,9}[.)])(?:[ \t\r\n]|$)')
+
+# ATX heading, it never continues a paragraph
+_HEADING_REGEX = re.compile(r' {0,3}#{1,6}(?:[ \t\r\n]|$)')
+
+# Run of backticks, opening or closing an inline code span
+_BACKTICKS_REGEX = re.compile(r'`+')
+
+# Indentation that can start an indented code block, at the start of the text and after a line separator. The
+# separator leads the pattern so search() can skip ahead to it, see _may_hold_code()
+_INDENT_REGEX = re.compile(r' {0,3}\t| {4}')
+_INDENTED_LINE_REGEX = re.compile(r'[\n\r\v\f\x1c-\x1e\x85\u2028\u2029](?: {0,3}\t| {4})')
+
+# Cheap pre-check for an <a> start tag, as html.parser tokenizes tag names. Strings without it can't be ahreflinks
+_ANCHOR_PRECHECK_REGEX = re.compile(r'<[aA](?![^\t\n\r\f />\x00])')
+
+
+# Link records, the parsed parts of a link. They are immutable and keep offsets into the source string instead of
+# copies of every part, parts are only sliced out when asked for. The *_split() functions return them as dictionaries
+class _LinkRecord:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _fields(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + ', '.join(
+            name + '=' + repr(value) for name, value in zip(self.__slots__, self._fields())) + ')'
+
+    def __reduce__(self):
+        return _rebuild_link_record, (type(self), self._fields())
+
+
+def _rebuild_link_record(cls, fields: tuple) -> _LinkRecord:
+    record = object.__new__(cls)
+    for name, value in zip(cls.__slots__, fields):
+        object.__setattr__(record, name, value)
+    return record
+
+
+class MdLink(_LinkRecord):
+    """
+    Markdown link i.e. ![title](path/to/file.png), with link_type 'urlmdlink', 'internalmdlink' or
+    'standardizedmdlink'. source[start:end] is the whole link.
+    """
+    __slots__ = ('source', 'link_type', 'start', 'end', 'title_start', 'title_end', 'path_start', 'filename_start',
+                 'filename_end')
+
+    def __init__(self, source: str, link_type: str, start: int, end: int, title_start: int, title_end: int,
+                 path_start: int, filename_start: int, filename_end: int):
+        _set = object.__setattr__
+        _set(self, 'source', source)
+        _set(self, 'link_type', link_type)
+        _set(self, 'start', start)
+        _set(self, 'end', end)
+        _set(self, 'title_start', title_start)
+        _set(self, 'title_end', title_end)
+        _set(self, 'path_start', path_start)
+        _set(self, 'filename_start', filename_start)
+        _set(self, 'filename_end', filename_end)
+
+    @property
+    def embedded(self) -> str:
+        # '!' + '[' come before the title
+        return '!' if self.title_start - self.start == 2 else ''
+
+    @property
+    def title(self) -> str:
+        return self.source[self.title_start:self.title_end]
+
+    @property
+    def path(self) -> str:
+        return self.source[self.path_start:self.filename_start]
+
+    @property
+    def filename(self) -> str:
+        return self.source[self.filename_start:self.filename_end]
+
+    @property
+    def url(self) -> Optional[str]:
+        if self.link_type != 'urlmdlink':
+            return None
+        return self.source[self.path_start:self.filename_end]
+
+    def as_dictionary(self, split_url: bool = True) -> dict:
+        """
+        Compatibility adapter: the link as mdlink_split() returns it, or internal_mdlink_split() with split_url=False.
+        Url links have 'Url' instead of 'Path' and 'Filename' when split_url is set.
+        """
+        if split_url and self.link_type == 'urlmdlink':
+            return {
+                'Embedded': self.embedded,
+                'Title': self.title,
+                'Url': self.url
+            }
+
+        return {
+            'Embedded': self.embedded,
+            'Title': self.title,
+            'Path': self.path,
+            'Filename': self.filename
+        }
+
+
+class WikiLink(_LinkRecord):
+    """
+    Wikilink i.e. [[mdfile]]. source[start:end] is the double-bracketed link, the target is the text inside.
+    """
+    __slots__ = ('source', 'start', 'end')
+
+    link_type = 'wikilink'
+
+    def __init__(self, source: str, start: int, end: int):
+        _set = object.__setattr__
+        _set(self, 'source', source)
+        _set(self, 'start', start)
+        _set(self, 'end', end)
+
+    @property
+    def target(self) -> str:
+        return self.source[self.start + 2:self.end - 2]
+
+    def as_dictionary(self) -> dict:
+        """
+        Compatibility adapter: the link as wikilink_split() returns it.
+        """
+        return {
+            'wikilink': self.target
+        }
+
+
+class AnchorLink(_LinkRecord):
+    """
+    HTML anchor i.e. <a href='url'>title</a>, starting at source[start]. Title and url are kept as values, html.parser
+    has already decoded their character references.
+    """
+    __slots__ = ('source', 'start', 'title', 'url', 'classes')
+
+    link_type = 'ahreflink'
+
+    def __init__(self, source: str, start: int, title: Optional[str], url: Optional[str], classes: Tuple[str, ...]):
+        _set = object.__setattr__
+        _set(self, 'source', source)
+        _set(self, 'start', start)
+        _set(self, 'title', title)
+        _set(self, 'url', url)
+        _set(self, 'classes', classes)
+
+    def as_dictionary(self) -> dict:
+        """
+        Compatibility adapter: the link as ahreflink_split() returns it.
+        """
+        return {
+            'Title': self.title,
+            'Url': self.url,
+            'Class': list(self.classes) or ''
+        }
 
 
 # Convert any link to standarized format
-def anylink_to_standarizedmdlink(link: str) -> Union[bool, str]:
-    linktype = link_type(link)
+# resolver: optional function from a wikilink target to the path to link to, see wikilink_to_mdlink()
+def anylink_to_standarizedmdlink(link: str, resolver=None) -> Union[bool, str]:
+    cache = _link_cache
+
+    # Resolved links depend on the resolver, they're not cached
+    if cache is not None and resolver is None:
+        linktype, result = cache.lookup(link, _convert_link)
+    else:
+        linktype, result = _convert_link(link, resolver)
+
+    if _instrumentation is not None:
+        _instrumentation.count(linktype, link, result)
+
+    return result
+
+
+# Convert a batch of links at once
+def batch_anylink_to_standarizedmdlink(links: Iterable[str], resolver=None, workers: Optional[int] = 1,
+                                       chunksize: int = 1024) -> List[Tuple[Union[bool, str], Union[bool, str]]]:
+    """
+    Standarize many links like anylink_to_standarizedmdlink() does one by one. Repeated links are classified and
+    converted once, and the unique links can be spread over worker processes.
+
+    :iterable links: Link strings, i.e. the links an indexer or exporter collected
+    :callable resolver: Optional wikilink resolver, see wikilink_to_mdlink(). With workers it must be picklable
+    :int workers: Worker processes, None for one per CPU. With 1, or fewer unique links than chunksize, everything is
+                  converted in this process
+    :int chunksize: Unique links sent to a worker at a time
+
+    :return: returns a list of (link type, standarized link or False), in the order of links. Link types are the ones
+             link_type() returns
+    """
+    links = list(links)
+    unique = list(dict.fromkeys(links))
+
+    if workers != 1 and len(unique) > chunksize:
+        import multiprocessing
+
+        chunks = [(unique[i:i + chunksize], resolver) for i in range(0, len(unique), chunksize)]
+        with multiprocessing.Pool(workers) as pool:
+            converted = [result for results in pool.starmap(_convert_links, chunks) for result in results]
+    else:
+        converted = _convert_links(unique, resolver)
+
+    results = dict(zip(unique, converted))
+
+    if _instrumentation is not None:
+        for link in links:
+            linktype, result = results[link]
+            _instrumentation.count(linktype, link, result)
+
+    return [results[link] for link in links]
+
+
+# Convert a list of links, through the link cache when it's on, see anylink_to_standarizedmdlink()
+def _convert_links(links: List[str], resolver=None) -> List[Tuple[Union[bool, str], Union[bool, str]]]:
+    cache = _link_cache
+
+    if cache is not None and resolver is None:
+        return [cache.lookup(link, _convert_link) for link in links]
+
+    return [_convert_link(link, resolver) for link in links]
+
+
+# Convert a link, returns (link type, standarized link or False)
+def _convert_link(link: str, resolver=None) -> Tuple[Union[bool, str], Union[bool, str]]:
+    record = parse_link(link)
+    linktype = record and record.link_type
 
     if linktype == 'wikilink':
-        return wikilink_to_mdlink(link)
+        return linktype, _wikilink_record_to_mdlink(record, resolver)
     elif linktype == 'internalmdlink':
-        return internal_mdlink_to_standarizedinternal_mdlink(link)
+        return linktype, _internal_mdlink_record_to_standarizedinternal_mdlink(record)
     elif linktype == 'standardizedmdlink':
-        return link
+        return linktype, link
     else:
+        return linktype, False
+
+
+# Bounded memoization of anylink_to_standarizedmdlink(), off unless enable_link_cache() is called.
+# Vaults repeat the same links ([[Index]], shared images, daily notes) over and over
+class _LinkCache:
+    """
+    Bounded cache of link conversions with 'lru' (least recently used) or 'fifo' (oldest first) eviction. Lookups
+    and inserts are done under a lock, so threads can share it. Every process has its own cache and its own stats.
+    """
+
+    def __init__(self, maxsize: int, policy: str):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        if policy not in ('lru', 'fifo'):
+            raise ValueError("policy must be 'lru' or 'fifo'")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, link: str, convert) -> tuple:
+        with self._lock:
+            try:
+                result = self._entries[link]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if self.policy == 'lru':
+                    self._entries.move_to_end(link)
+                return result
+
+        # Convert outside the lock, other threads can keep hitting the cache meanwhile
+        result = convert(link)
+
+        with self._lock:
+            self._entries[link] = result
+
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'Hits': self.hits,
+                'Misses': self.misses,
+                'Evictions': self.evictions,
+                'Size': len(self._entries),
+                'Maxsize': self.maxsize,
+                'Policy': self.policy
+            }
+
+    def _after_fork(self):
+        # The lock may have been held by another thread of the parent when it forked
+        self._lock = threading.Lock()
+
+
+_link_cache = None
+
+
+# Turn on the link conversion cache, replacing the current one
+def enable_link_cache(maxsize: int = 4096, policy: str = 'lru'):
+    """
+    Memoize anylink_to_standarizedmdlink(), and so every multiline and vault conversion.
+
+    :int maxsize: Links kept at most
+    :string policy: Which link is evicted when full: 'lru' the least recently used, 'fifo' the oldest
+    """
+    global _link_cache
+    _link_cache = _LinkCache(maxsize, policy)
+
+
+# Turn off the link conversion cache
+def disable_link_cache():
+    global _link_cache
+    _link_cache = None
+
+
+# Empty the link conversion cache and reset its stats, i.e. between vaults
+def clear_link_cache():
+    if _link_cache is not None:
+        _link_cache.clear()
+
+
+# Hits, misses and evictions of the link conversion cache, or False if it's off
+def link_cache_stats() -> Union[dict, bool]:
+    if _link_cache is None:
+        return False
+
+    return _link_cache.stats()
+
+
+def _link_cache_after_fork():
+    if _link_cache is not None:
+        _link_cache._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_link_cache_after_fork)
+
+
+# Optional instrumentation of anylink_to_standarizedmdlink(), off unless enable_instrumentation() is called.
+# While it's on, the functions of every phase are swapped for timed wrappers, so there's no cost at all while it's off
+_INSTRUMENTED_PHASES = {
+    # Recognizing md links and wikilinks
+    '_parse_mdlink': 'classification',
+    '_parse_wikilink': 'classification',
+    # Looking for <a> anchors with html.parser
+    '_parse_first_anchor': 'html',
+    # Taking the link apart and building the standarized one, percent-encoding included
+    '_wikilink_record_to_mdlink': 'splitting',
+    '_internal_mdlink_record_to_standarizedinternal_mdlink': 'splitting',
+    # Percent-encoding and decoding of filenames
+    '_quote': 'encoding',
+    '_unquote': 'encoding'
+}
+
+# Filename codec: the same results as urllib.parse.quote() and unquote() with their defaults, from precomputed tables.
+# Bytes quote() never escapes, with its default safe='/'
+_QUOTE_SAFE_BYTES = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_.-~/'
+
+# str.translate() table from an ASCII char, or a UTF-8 byte decoded as latin-1, to its percent-encoded form
+_QUOTE_TABLE = tuple(chr(byte) if byte in _QUOTE_SAFE_BYTES else f'%{byte:02X}' for byte in range(256))
+
+# Any char quote() would escape
+_QUOTE_UNSAFE_REGEX = re.compile(r'[^A-Za-z0-9_.\-~/]')
+
+# Percent-encoded byte, either hex case, and the byte it stands for
+_PERCENT_BYTE_REGEX = re.compile(rb'%([0-9A-Fa-f]{2})')
+_HEX_TO_BYTE = {(high + low).encode(): bytes.fromhex(high + low) for high in '0123456789ABCDEFabcdef'
+                for low in '0123456789ABCDEFabcdef'}
+
+# Runs of ASCII chars, unquote() decodes every run on its own
+_ASCII_RUN_REGEX = re.compile('([\x00-\x7f]+)')
+
+# A name quote(unquote(name)) leaves as it is: safe chars, and uppercase escapes of the bytes quote() escapes that
+# decode as UTF-8, i.e. 'Some%20Note.md'
+_CANONICAL_QUOTED_REGEX = re.compile(r"""
+    (?:[A-Za-z0-9_.\-~/]
+      | %(?:[01][0-9A-F]|2[0-9A-C]|3[A-F]|40|5[B-E]|60|7[BCDF])               # ASCII
+      | %(?:C[2-9A-F]|D[0-9A-F])%[89AB][0-9A-F]                                # 2 bytes
+      | %(?:E0%[AB][0-9A-F]|E[1-9A-CEF]%[89AB][0-9A-F]|ED%[89][0-9A-F])%[89AB][0-9A-F]   # 3 bytes
+      | %(?:F0%[9AB][0-9A-F]|F[1-3]%[89AB][0-9A-F]|F4%8[0-9A-F])(?:%[89AB][0-9A-F]){2}   # 4 bytes
+    )*""", re.VERBOSE)
+
+
+# Percent-encode a filename, like urllib.parse.quote(). Through module names so instrumentation can time it
+def _quote(string: str) -> str:
+    if string.isascii():
+        # Plain names, nothing to escape
+        if not _QUOTE_UNSAFE_REGEX.search(string):
+            return string
+
+        return string.translate(_QUOTE_TABLE)
+
+    return string.encode('utf-8').decode('latin-1').translate(_QUOTE_TABLE)
+
+
+# Decode a percent-encoded filename, like urllib.parse.unquote(): invalid UTF-8 is replaced, invalid escapes are kept
+def _unquote(string: str) -> str:
+    if '%' not in string:
+        return string
+
+    if string.isascii():
+        return _unquote_ascii(string)
+
+    pieces = _ASCII_RUN_REGEX.split(string)
+    for i in range(1, len(pieces), 2):
+        pieces[i] = _unquote_ascii(pieces[i])
+
+    return ''.join(pieces)
+
+
+def _unquote_ascii(string: str) -> str:
+    if '%' not in string:
+        return string
+
+    return _PERCENT_BYTE_REGEX.sub(_percent_byte, string.encode('ascii')).decode('utf-8', 'replace')
+
+
+def _percent_byte(match) -> bytes:
+    return _HEX_TO_BYTE[match.group(1)]
+
+
+# quote(unquote(name)), skipping both for names already encoded that way
+def _requote(string: str) -> str:
+    # Nothing to decode
+    if '%' not in string:
+        return _quote(string)
+
+    if _CANONICAL_QUOTED_REGEX.fullmatch(string):
+        return string
+
+    return _quote(_unquote(string))
+
+
+class _Instrumentation:
+    """
+    Counts of the links seen by anylink_to_standarizedmdlink() per link type, and time spent in every phase.
+    """
+
+    def __init__(self, hook):
+        self.hook = hook
+        self.reset()
+
+    def reset(self):
+        self.links = {}
+        self.seconds = dict.fromkeys(sorted(set(_INSTRUMENTED_PHASES.values())), 0.0)
+        self.calls = dict.fromkeys(self.seconds, 0)
+
+    def count(self, linktype: Union[bool, str], link: str, result: Union[bool, str]):
+        counts = self.links.get(linktype or 'nolink')
+        if counts is None:
+            counts = self.links[linktype or 'nolink'] = {'Seen': 0, 'Converted': 0, 'Unchanged': 0, 'Rejected': 0}
+
+        counts['Seen'] += 1
+        if result is False:
+            counts['Rejected'] += 1
+        elif result == link:
+            counts['Unchanged'] += 1
+        else:
+            counts['Converted'] += 1
+
+    def timed(self, phase: str, function):
+        perf_counter = time.perf_counter
+
+        def timed_function(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                self.seconds[phase] += elapsed
+                self.calls[phase] += 1
+                if self.hook is not None:
+                    self.hook(phase, elapsed)
+
+        timed_function.__wrapped__ = function
+        return timed_function
+
+    def stats(self) -> dict:
+        return {
+            'Links': {linktype: dict(counts) for linktype, counts in self.links.items()},
+            'Seconds': dict(self.seconds),
+            'Calls': dict(self.calls)
+        }
+
+
+_instrumentation = None
+
+
+# Turn on instrumentation, starting from zero
+def enable_instrumentation(hook=None):
+    """
+    Count the links anylink_to_standarizedmdlink() sees, converts and rejects by link type, and time the
+    'classification', 'html', 'splitting' and 'encoding' phases. 'splitting' includes the 'encoding' it does.
+
+    :callable hook: Called as hook(phase, seconds) after every timed call, to feed your own profiler
+    """
+    disable_instrumentation()
+
+    global _instrumentation
+    _instrumentation = _Instrumentation(hook)
+
+    for name, phase in _INSTRUMENTED_PHASES.items():
+        globals()[name] = _instrumentation.timed(phase, globals()[name])
+
+
+# Turn off instrumentation, putting the original functions back
+def disable_instrumentation():
+    global _instrumentation
+
+    if _instrumentation is None:
+        return
+
+    for name in _INSTRUMENTED_PHASES:
+        globals()[name] = globals()[name].__wrapped__
+
+    _instrumentation = None
+
+
+# Start counting and timing from zero again
+def reset_instrumentation():
+    if _instrumentation is not None:
+        _instrumentation.reset()
+
+
+# Link counts and phase times, or False if instrumentation is off
+def instrumentation_stats() -> Union[dict, bool]:
+    """
+    :return: returns {'Links': {link type: {'Seen', 'Converted', 'Unchanged', 'Rejected'}},
+             'Seconds': {phase: seconds}, 'Calls': {phase: calls}}. Strings that are not links count as 'nolink'
+    """
+    if _instrumentation is None:
         return False
 
+    return _instrumentation.stats()
+
+
+# Add up instrumentation stats, i.e. from several worker processes
+def merge_instrumentation_stats(stats: dict, other: dict) -> dict:
+    merged = {'Links': {}, 'Seconds': {}, 'Calls': {}}
+
+    for source in (stats, other):
+        for linktype, counts in source.get('Links', {}).items():
+            merged_counts = merged['Links'].setdefault(linktype, {})
+            for key, value in counts.items():
+                merged_counts[key] = merged_counts.get(key, 0) + value
+
+        for section in ('Seconds', 'Calls'):
+            for key, value in source.get(section, {}).items():
+                merged[section][key] = merged[section].get(key, 0) + value
+
+    return merged
+
+
+# Save instrumentation stats as JSON, i.e. at the end of a batch run
+def dump_instrumentation(path: str, stats: Optional[dict] = None):
+    import json
+
+    if stats is None:
+        stats = instrumentation_stats()
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2)
+
 
 # Convert internal mdlinks to standarizedinternalmdlink
 def internal_mdlink_to_standarizedinternal_mdlink(mdlink):
@@ -35,37 +633,38 @@ def internal_mdlink_to_standarizedinternal_mdlink(mdlink):
     """
 
     # Check this is an internal mdlink
-    var_type = link_type(mdlink)
+    record = parse_link(mdlink)
 
-    if var_type == 'internalmdlink':
-        # Get parts of mdlink
-        mdlink_dictionary = mdlink_split(mdlink)
+    if record and record.link_type == 'internalmdlink':
+        return _internal_mdlink_record_to_standarizedinternal_mdlink(record)
 
-        if not mdlink_dictionary:
-            # Something went wrong
-            return False
+    else:
+        return False
 
-        else:
-            # Check if title is already double-bracketed, in that case leave it as is
-            groups = re.search(r'\[.*].*', mdlink_dictionary['Title'])
-            if not groups:
-                # Add another pair of brackets and set up url decoded filename as title
-                mdlink_dictionary['Title'] = "[" + urllib.parse.unquote(mdlink_dictionary['Filename']) + "]"
 
-            # Decode and encode filename to make sure its encoded
-            mdlink_dictionary['Filename'] = urllib.parse.quote(urllib.parse.unquote(mdlink_dictionary['Filename']))
-            wikilink = mdlink_dictionary['Embedded'] + "[" + mdlink_dictionary['Title'] + "]" + "(" + mdlink_dictionary[
-                'Path'] + mdlink_dictionary['Filename'] + ")"
+# Build the standarizedinternalmdlink from an already classified internal mdlink
+def _internal_mdlink_record_to_standarizedinternal_mdlink(record: MdLink) -> str:
+    title = record.title
+    filename = record.filename
 
-            return wikilink
+    # Check if title is already double-bracketed, in that case leave it as is
+    if not _has_bracketed_text(title):
+        # Add another pair of brackets and set up url decoded filename as title
+        title = "[" + _unquote(filename) + "]"
 
-    else:
-        return False
+    # Decode and encode filename to make sure its encoded
+    filename = _requote(filename)
+    wikilink = record.embedded + "[" + title + "]" + "(" + record.path + filename + ")"
+
+    return wikilink
 
 
 # Convert wiki style embedded images (e.g. Obsidian app) ![[image nice.jpg]] and links [[linked file]] to
 # compatible markdown ![[]](image%20nice.jpg)
-def wikilink_to_mdlink(wikilink):
+#
+# resolver: optional function that takes the wikilink target and returns the path of the note or file it points to,
+# or None to fall back to the bare name. i.e. link_index.FilenameIndex(vault).resolver()
+def wikilink_to_mdlink(wikilink, resolver=None):
     # The trick here is that with double brackets we get compatibility for both wiki-style linkers (1writer,
     # Obsidian for example) and standard markdown editors such as Typora.
     #
@@ -73,40 +672,43 @@ def wikilink_to_mdlink(wikilink):
     # view will show links inside single brackets - not big deal for me.
 
     # First, confirm this is a wikilink
-    var_type = link_type(wikilink)
+    record = parse_link(wikilink)
 
-    if var_type == 'wikilink':
-        wikilink_dictionary = wikilink_split(wikilink)
-        filename = wikilink_dictionary['wikilink']
+    if record and record.link_type == 'wikilink':
+        return _wikilink_record_to_mdlink(record, resolver)
+    else:
+        return False
 
+
+# Build the markdown link from an already classified wikilink
+def _wikilink_record_to_mdlink(record: WikiLink, resolver=None) -> str:
+    filename = record.target
+    resolved = resolver(filename) if resolver is not None else None
+
+    if resolved is not None:
+        filename = resolved
+    else:
         # Check if its a link to another md note
-        groups = re.search(r'.*\..*', filename)
-        if not groups:
+        if not _has_extension(filename):
             # Add ".md" to the filename
             filename += ".md"
 
-        # URL-encode it
-        urlencoded_filename = urllib.parse.quote(filename)
+    # URL-encode it
+    urlencoded_filename = _quote(filename)
 
-        # Now build the markdown link
-        mdlink = wikilink + "(" + urlencoded_filename + ")"
+    # Now build the markdown link
+    mdlink = record.source + "(" + urlencoded_filename + ")"
 
-        return mdlink
-    else:
-        return False
+    return mdlink
 
 
 # Split wikilink in it's parts
 def wikilink_split(wikilink):
     # Extract the link
-    groups = re.search(r'\[\[(.*?)]]', wikilink)
+    record = _parse_wikilink(wikilink)
 
-    if groups:
-        wikilink_dictionary = {
-            'wikilink': groups.group(1)
-        }
-
-        return wikilink_dictionary
+    if record:
+        return record.as_dictionary()
     else:
         # Something went wrong
         return False
@@ -115,18 +717,10 @@ def wikilink_split(wikilink):
 # Split markdown links in it's parts, else return False
 def mdlink_split(mdlink):
     # First check if it is an internal link or url link
-    mdlink_dictionary = internal_mdlink_split(mdlink)
-
-    if mdlink_dictionary:
-        # Now see if it's URL
-        url_split = urllib.parse.urlparse(mdlink_dictionary['Path'])
+    record = _parse_mdlink(mdlink)
 
-        if url_split.scheme != '':
-            mdlink_dictionary['Url'] = mdlink_dictionary['Path'] + mdlink_dictionary['Filename']
-            del mdlink_dictionary['Filename']
-            del mdlink_dictionary['Path']
-
-        return mdlink_dictionary
+    if record:
+        return record.as_dictionary()
     else:
         return False
 
@@ -135,56 +729,577 @@ def mdlink_split(mdlink):
 # 'Title'
 # 'Url'
 # 'Class'
-def ahreflink_split(ahreflink):
+def ahreflink_split(ahreflink, use_bs4: bool = False):
+    """
+    Split the first <a> anchor of the string in its parts.
+
+    :string ahreflink: Expects an HTML formatted link i.e. <a href='url'>title</a>
+    :bool use_bs4: Parse with BeautifulSoup instead of the standard library parser. Needs bs4 installed
+
+    :return: returns a dictionary with 'Title', 'Url' and 'Class', or False if it is not an ahreflink
+    """
     # First check it's the correct link type
-    var_type = link_type(ahreflink)
+    record = parse_link(ahreflink)
 
-    if var_type == 'ahreflink':
-        soup = BeautifulSoup(ahreflink, 'html.parser')
+    if record and record.link_type == 'ahreflink':
+        if use_bs4:
+            return _bs4_ahreflink_split(ahreflink)
 
-        a_soup = soup.find('a')
+        return record.as_dictionary()
+    else:
+        return False
 
-        ahreflink_dictionary = {
-            'Title': a_soup.string,
-            'Url': a_soup.get('href'),
-            'Class': a_soup.get('class')
-        }
 
-        # Clean optional components
-        if not ahreflink_dictionary['Class']:
-            ahreflink_dictionary['Class'] = ''
+# Split a href link with BeautifulSoup, imported only when asked for
+def _bs4_ahreflink_split(ahreflink: str) -> dict:
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError as e:
+        raise ImportError("use_bs4 needs BeautifulSoup: pip install beautifulsoup4") from e
 
-        return ahreflink_dictionary
-    else:
+    soup = BeautifulSoup(ahreflink, 'html.parser')
+
+    a_soup = soup.find('a')
+
+    ahreflink_dictionary = {
+        'Title': a_soup.string,
+        'Url': a_soup.get('href'),
+        'Class': a_soup.get('class')
+    }
+
+    # Clean optional components
+    if not ahreflink_dictionary['Class']:
+        ahreflink_dictionary['Class'] = ''
+
+    return ahreflink_dictionary
+
+
+# Extract the first <a> anchor of the string with the standard library html.parser
+def _parse_first_anchor(string: str) -> Union[AnchorLink, bool]:
+    # Quick exit for strings that don't even have an <a tag
+    if not _ANCHOR_PRECHECK_REGEX.search(string):
+        return False
+
+    import anchor_parser
+
+    parser = anchor_parser.AnchorParser()
+    try:
+        parser.feed(string)
+        parser.close()
+    except AssertionError:
+        # html.parser gives up on malformed markup like '<![x'. Keep whatever anchor was found before it
+        pass
+
+    parts = parser.anchor_parts(string)
+    if parts is None:
         return False
 
+    return AnchorLink(string, *parts)
+
+
+# Convert every <a href> anchor of a text to a markdown link
+# skip_code: leave fenced blocks, indented blocks and inline code as they are, see _CodeLexer
+def multiline_ahreflink_to_mdlink(lines: str, skip_code: bool = True) -> str:
+    return ''.join(stream_ahreflink_to_mdlink(lines.splitlines(True), skip_code=skip_code))
+
+
+# Convert the <a href> anchors of lines of text to markdown links, streaming
+def stream_ahreflink_to_mdlink(lines: Iterable[str], max_anchor_length: int = 4096,
+                               skip_code: bool = True) -> Iterator[str]:
+    """
+    Rewrite <a href='url'>title</a> anchors as [title](url) markdown links, with a single html.parser pass over the
+    text. Title and url are extracted like ahreflink_split() does; anchors with markup inside use all of their text
+    as title. Anchors without href are left as they are.
+
+    Lines are yielded as soon as no anchor is open in them, so it can be chained with stream_anylink_standarize().
+    An anchor can span lines, the lines are joined then. Code is never handed to html.parser, so anchors in code
+    samples stay as they are, and an anchor with code inside is left as it is too.
+
+    :iterable lines: Any iterable of lines, i.e. a list of str or a text file object. A single str is split in lines
+    :int max_anchor_length: Anchors longer than this, i.e. a missing </a>, are left as they are. So are unclosed
+                            <script>, <style>, comments and CDATA sections. Keeps memory bounded
+    :bool skip_code: Copy fenced blocks, indented blocks and inline code through untouched
+
+    :return: returns an iterator over the converted lines
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines(True)
+
+    import anchor_parser
+
+    rewriter = anchor_parser.AnchorRewriter(max_anchor_length)
+    lexer = _CodeLexer() if skip_code else None
+
+    for ln in lines:
+        spans = lexer.prose_spans(ln) if lexer is not None else None
+
+        if lexer is None or spans == [] or spans == [(0, len(ln))]:
+            rewriter.feed(ln)
+        elif spans is None:
+            rewriter.feed_verbatim(ln)
+        else:
+            # Prose around inline code
+            lastpos = 0
+            for start, end in spans:
+                if start > lastpos:
+                    rewriter.feed_verbatim(ln[lastpos:start])
+                if end > start:
+                    rewriter.feed(ln[start:end])
+                lastpos = end
+
+        yield from rewriter.pop_lines()
+
+    rewriter.close()
+    yield from rewriter.pop_lines(final=True)
+
 
 # Find links in a text file and standarizes it, line by line
-def multiline_anylink_standarize(lines: str) -> str:
-    split_lines = lines.splitlines(True)
-    result = ''
-
-    for ln in split_lines:
-        # Find any type of standarizable links: wikilinks and internalmdlinks
-        regex = re.compile(r"(!?\[{1,2}[^]]*?]{1,2}\(.*?\)|!?\[{2}.*?]{2}(?!\())")
-        matches = regex.finditer(ln)
-        fixlength = 0
-
-        for m in matches:
-            standarizedmdlink = anylink_to_standarizedmdlink(m.group(0))
-            startpos = m.start(0) - fixlength
-            endpos = m.end(0) - fixlength
-
-            if (standarizedmdlink is not False):
-                ln = ln[: startpos] + standarizedmdlink + ln[endpos:]
-                fixlength = len(m.group(0)) - len(standarizedmdlink)
+# resolver: optional wikilink resolver, see wikilink_to_mdlink()
+# skip_code: leave fenced blocks, indented blocks and inline code as they are, see _CodeLexer
+def multiline_anylink_standarize(lines: str, resolver=None, skip_code: bool = True) -> str:
+    return _standarize_text(lines, resolver, skip_code)[0]
+
+
+# Find links in lines of text and standarizes them, one line at a time
+def stream_anylink_standarize(lines: Iterable[str], resolver=None, skip_code: bool = True) -> Iterator[str]:
+    """
+    Standarize the links of every line, yielding lines as they are processed so memory doesn't grow with the input.
+
+    :iterable lines: Any iterable of lines, i.e. a list of str or a text file object. A single str is split in lines
+    :callable resolver: Optional wikilink resolver, see wikilink_to_mdlink()
+    :bool skip_code: Copy fenced blocks, indented blocks and inline code through untouched
+
+    :return: returns an iterator over the standarized lines, line endings are kept as they are
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines(True)
+
+    if not skip_code:
+        for ln in lines:
+            yield _standarize_line(ln, resolver)[0]
+        return
+
+    lexer = _CodeLexer()
+    for ln in lines:
+        yield _standarize_spans(ln, lexer.prose_spans(ln), resolver)[0]
+
+
+# Standarize a whole text, handing only the lines that may have links to the link parser. Every standarizable link
+# starts with '[', so str.find() jumps over the prose in between and it is copied through untouched. Texts that may
+# hold code go through _CodeLexer line by line instead, so code regions are copied through too
+# Returns the text and how many links changed
+def _standarize_text(text: str, resolver=None, skip_code: bool = True) -> Tuple[str, int]:
+    pos = text.find('[')
+
+    # No link syntax at all, most notes with no links
+    if pos < 0:
+        return text, 0
+
+    if skip_code and _may_hold_code(text):
+        return _standarize_lexed_text(text, resolver)
+
+    pieces = []
+    lastpos = 0
+    links_changed = 0
+
+    while pos >= 0:
+        # Candidate region: the '\n' terminated line around the bracket. It can hold more than one line for
+        # splitlines(), i.e. lines ending in '\r' alone, so it is split the same way multiline_anylink_standarize()
+        # always did
+        region_start = text.rfind('\n', lastpos, pos) + 1 or lastpos
+        region_end = text.find('\n', pos) + 1 or len(text)
+
+        for ln in text[region_start:region_end].splitlines(True):
+            standarized_ln, changed = _standarize_line(ln, resolver)
+
+            if changed:
+                pieces.append(text[lastpos:region_start])
+                pieces.append(standarized_ln)
+                lastpos = region_start + len(ln)
+                links_changed += changed
+
+            region_start += len(ln)
+
+        pos = text.find('[', region_end)
+
+    # Nothing changed, don't copy the text
+    if not pieces:
+        return text, 0
+
+    pieces.append(text[lastpos:])
+
+    return ''.join(pieces), links_changed
+
+
+# Anything that can start a code region: a backtick, a ~~~ fence or an indented line. Texts without any are all prose
+def _may_hold_code(text: str) -> bool:
+    return ('`' in text or '~~~' in text or _INDENT_REGEX.match(text) is not None
+            or _INDENTED_LINE_REGEX.search(text) is not None)
+
+
+# Standarize the prose of a text that may hold code, in a single pass of _CodeLexer over its lines. A lexer can be
+# given to start from its state, it's left in the state the text ends in
+def _standarize_lexed_text(text: str, resolver=None, lexer: Optional['_CodeLexer'] = None) -> Tuple[str, int]:
+    if lexer is None:
+        lexer = _CodeLexer()
+    lines = []
+    links_changed = 0
+
+    for ln in text.splitlines(True):
+        spans = lexer.prose_spans(ln)
+
+        if spans and '[' in ln:
+            ln, changed = _standarize_spans(ln, spans, resolver)
+            links_changed += changed
+
+        lines.append(ln)
+
+    # Nothing changed, don't copy the text
+    if not links_changed:
+        return text, 0
+
+    return ''.join(lines), links_changed
+
+
+# Standarize a chunk of a larger text, the way multiline_anylink_standarize() standarizes the whole text.
+# fence_state is the (fence, list item) state of the code lexer when the chunk starts inside a fenced block, and None
+# when it starts out of fenced blocks, at an unindented line after a blank line: nothing before such a line changes
+# how it is lexed. Returns the standarized chunk, the links changed and the fence state it ends in
+def _standarize_chunk(text: str, resolver=None, skip_code: bool = True,
+                      fence_state: Optional[Tuple[str, bool]] = None) -> Tuple[str, int, Optional[Tuple[str, bool]]]:
+    # Nothing that can start code, no need to look for it again
+    if not skip_code or (fence_state is None and not _may_hold_code(text)):
+        return (*_standarize_text(text, resolver, skip_code=False), None)
+
+    lexer = _CodeLexer()
+    if fence_state is not None:
+        lexer.fence, lexer.list_item = fence_state
+
+    text, links_changed = _standarize_lexed_text(text, resolver, lexer)
+
+    return text, links_changed, (lexer.fence, lexer.list_item) if lexer.fence is not None else None
+
+
+# Find the links of a text, as multiline_anylink_standarize() sees them
+def iter_links(lines: Iterable[str], skip_code: bool = True) -> Iterator[Tuple[int, int, int,
+                                                                            Union[MdLink, WikiLink, AnchorLink]]]:
+    """
+    Find every mdlink and wikilink in the lines, the same ones multiline_anylink_standarize() would standarize.
+
+    :iterable lines: Any iterable of lines, i.e. a list of str or a text file object. A single str is split in lines
+    :bool skip_code: Don't look for links in fenced blocks, indented blocks and inline code
+
+    :return: returns an iterator of (line number, start, end, record). Line numbers start at 1, start and end are the
+             link span in the line and the record is parse_link() of the link alone
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines(True)
+
+    lexer = _CodeLexer() if skip_code else None
+
+    for line_number, ln in enumerate(lines, 1):
+        spans = lexer.prose_spans(ln) if lexer is not None else ((0, len(ln)),)
+
+        # Fast reject: no link syntax in the line
+        if not spans or '[' not in ln:
+            continue
+
+        deadline = _line_deadline()
+
+        try:
+            for span_start, span_end in spans:
+                for start, end in _iter_link_spans(ln, span_start, span_end, deadline):
+                    record = parse_link(ln[start:end])
+
+                    if record:
+                        yield line_number, start, end, record
+        except _LineTimeBudgetExceeded:
+            # The rest of the line is left out
+            continue
+
+
+# Tracks the code regions of a markdown document one line at a time, the way CommonMark sees them: fenced blocks
+# (``` and ~~~), indented blocks and inline code spans. Code never holds links, so only the prose spans of a line are
+# handed to the link parser. Every line is looked at once, and only its first chars unless it's prose with backticks
+class _CodeLexer:
+    __slots__ = ('fence', 'paragraph', 'list_item', 'indented_code')
+
+    def __init__(self):
+        # Opening fence of the fenced block we are in, i.e. '```'. A closing fence starts with it
+        self.fence = None
+        # Last line was paragraph text. An indented line continues the paragraph, it doesn't start a code block
+        self.paragraph = False
+        # Inside a list, indented lines are the content of an item
+        self.list_item = False
+        self.indented_code = False
+
+    # Prose spans of the next line as (start, end) pairs. None when the whole line is code
+    def prose_spans(self, ln: str) -> Optional[List[Tuple[int, int]]]:
+        indent = _indent_width(ln)
+
+        if self.fence is not None:
+            if indent < 4 or self.list_item:
+                m = _CODE_FENCE_REGEX.match(ln, len(ln) - len(ln.lstrip(' \t')))
+                if m and m.group(1).startswith(self.fence) and not m.group(2).strip():
+                    self.fence = None
+            return None
+
+        # Blank line
+        if not ln.strip():
+            self.paragraph = False
+            return []
+
+        if indent >= 4 and (self.indented_code or not (self.paragraph or self.list_item)):
+            self.indented_code = True
+            return None
+
+        self.indented_code = False
+
+        if indent < 4 or self.list_item:
+            m = _CODE_FENCE_REGEX.match(ln, len(ln) - len(ln.lstrip(' \t')))
+            # Backtick fences can't have backticks in the info string, that's inline code
+            if m and not (m.group(1)[0] == '`' and '`' in m.group(2)):
+                self.fence = m.group(1)
+                self.paragraph = False
+                return None
+
+        if _LIST_ITEM_REGEX.match(ln):
+            self.list_item = True
+        elif indent == 0 and not self.paragraph:
+            # Not indented after a blank line, the list is over
+            self.list_item = False
+
+        self.paragraph = not _HEADING_REGEX.match(ln)
+
+        return _inline_prose_spans(ln)
+
+
+# Width of the indentation of a line, up to 4. Tabs stop every 4 columns
+def _indent_width(ln: str) -> int:
+    width = 0
+
+    for char in ln:
+        if char == ' ':
+            width += 1
+        elif char == '\t':
+            width += 4 - width % 4
+        else:
+            break
+
+        if width >= 4:
+            break
+
+    return width
+
+
+# Prose spans of a line around its inline code spans. A run of backticks opens a code span that the next run of the
+# same length closes, runs with no closing run are just backticks
+def _inline_prose_spans(ln: str) -> List[Tuple[int, int]]:
+    if '`' not in ln:
+        return [(0, len(ln))]
+
+    runs = [m.span() for m in _BACKTICKS_REGEX.finditer(ln)]
+
+    # Indexes of the runs of every length, left to right. Runs behind the current one are dropped as it goes, so
+    # finding a closing run never looks back and the line is scanned once
+    same_length = {}
+    for i, (start, end) in enumerate(runs):
+        same_length.setdefault(end - start, deque()).append(i)
+
+    spans = []
+    prose_start = 0
+    i = 0
+
+    while i < len(runs):
+        start, end = runs[i]
+        closers = same_length[end - start]
+
+        while closers and closers[0] <= i:
+            closers.popleft()
+
+        if not closers:
+            i += 1
+            continue
+
+        closer = closers.popleft()
+        spans.append((prose_start, start))
+        prose_start = runs[closer][1]
+        i = closer + 1
+
+    spans.append((prose_start, len(ln)))
+
+    return spans
+
+
+# Standarize the prose spans of a line, the code in between is copied as it is
+# Returns the line and how many links changed
+def _standarize_spans(ln: str, spans: Optional[List[Tuple[int, int]]], resolver=None) -> Tuple[str, int]:
+    if not spans:
+        return ln, 0
+
+    # All prose, the usual case
+    if len(spans) == 1:
+        return _standarize_line(ln, resolver)
+
+    pieces = []
+    lastpos = 0
+    links_changed = 0
+    # The spans share the time budget of the line
+    deadline = _line_deadline()
+
+    for start, end in spans:
+        standarized, changed = _standarize_line(ln[start:end], resolver, deadline)
+
+        if changed:
+            pieces.append(ln[lastpos:start])
+            pieces.append(standarized)
+            lastpos = end
+            links_changed += changed
+
+    # Nothing changed, don't copy the line
+    if not pieces:
+        return ln, 0
+
+    pieces.append(ln[lastpos:])
+
+    return ''.join(pieces), links_changed
+
+
+# Standarize every link found in a single line. Links that can't be standarized are left as they are. A line that
+# takes longer than the time budget is left as it is, see set_line_time_budget()
+# Returns the line and how many links changed
+def _standarize_line(ln: str, resolver=None, deadline: Optional[float] = None) -> Tuple[str, int]:
+    # Fast reject: no link syntax in the line
+    if '[' not in ln:
+        return ln, 0
+
+    if deadline is None:
+        deadline = _line_deadline()
+
+    pieces = []
+    lastpos = 0
+
+    try:
+        for start, end in _iter_link_spans(ln, 0, len(ln), deadline):
+            link = ln[start:end]
+            standarizedmdlink = anylink_to_standarizedmdlink(link, resolver)
+
+            # Conversions and resolvers take time too, the deadline is checked after every link
+            if deadline is not None and time.perf_counter() > deadline:
+                raise _LineTimeBudgetExceeded()
+
+            if standarizedmdlink is not False and standarizedmdlink != link:
+                pieces.append(ln[lastpos:start])
+                pieces.append(standarizedmdlink)
+                lastpos = end
+    except _LineTimeBudgetExceeded:
+        return ln, 0
+
+    # Nothing changed, don't copy the line
+    if not pieces:
+        return ln, 0
+
+    links_changed = len(pieces) // 2
+    pieces.append(ln[lastpos:])
+
+    return ''.join(pieces), links_changed
+
+
+# Spans of the standarizable links in ln[pos:endpos]: mdlinks, standardized mdlinks and wikilinks. Same matches, in
+# the same order, as finditer() of the regex at the top of the module, in linear time
+def _iter_link_spans(ln: str, pos: int, endpos: int, deadline: Optional[float] = None) -> Iterator[Tuple[int, int]]:
+    """
+    A link starts at a '[', or at the '!' right before it, and is either
+
+    - '[' title '](' ... ')' or '[[' title ']](' ... ')': the title runs up to the first ']' and the link up to the
+      first ')' after the '(', with no newline in between
+    - '[[' ... ']]' not followed by '(', up to the first such ']]' with no newline in between
+
+    Every search below only moves forward: the next ']', ')', newline or ']]' found from an offset is kept and
+    reused until the scan goes past it, so every char is looked at a bounded number of times.
+    """
+    # Next ']' after the '[', next ')' after the '(', next ']]' not followed by '(', and next newlines. -2 when not
+    # searched yet, -1 when there is none left
+    bracket = paren = wikilink_end = title_newline = wikilink_newline = -2
+    candidates = 0
+
+    start = ln.find('[', pos, endpos)
+
+    while start >= 0:
+        candidates += 1
+        if deadline is not None and not candidates % 32 and time.perf_counter() > deadline:
+            raise _LineTimeBudgetExceeded()
+
+        link_start = start - 1 if start > pos and ln[start - 1] == '!' else start
+        end = -1
+
+        # '[' title ']' or '[[' title ']]', then '(' ... ')'
+        if bracket != -1 and bracket <= start:
+            bracket = ln.find(']', start + 1, endpos)
+
+        if bracket >= 0:
+            if ln.startswith('](', bracket, endpos):
+                opening = bracket + 1
+            elif ln.startswith(']](', bracket, endpos):
+                opening = bracket + 2
             else:
-                ln = ln + ln[: startpos] + m.group(0) + ln[endpos:]
-                fixlength = 0
+                opening = -1
+
+            if opening >= 0:
+                if paren != -1 and paren <= opening:
+                    paren = ln.find(')', opening + 1, endpos)
+                if title_newline != -1 and title_newline <= opening:
+                    title_newline = ln.find('\n', opening + 1, endpos)
+
+                if paren >= 0 and not 0 <= title_newline < paren:
+                    end = paren + 1
+
+        # '[[' ... ']]' not followed by '('
+        if end < 0 and ln.startswith('[[', start, endpos):
+            if wikilink_end != -1 and wikilink_end < start + 2:
+                wikilink_end = ln.find(']]', start + 2, endpos)
+                while wikilink_end >= 0 and ln.startswith('(', wikilink_end + 2, endpos):
+                    wikilink_end = ln.find(']]', wikilink_end + 1, endpos)
+            if wikilink_newline != -1 and wikilink_newline < start + 2:
+                wikilink_newline = ln.find('\n', start + 2, endpos)
+
+            if wikilink_end >= 0 and not 0 <= wikilink_newline < wikilink_end:
+                end = wikilink_end + 2
+
+        if end >= 0:
+            yield link_start, end
+            start = ln.find('[', end, endpos)
+            # The '!' of the next link can't be inside this one
+            pos = end
+        else:
+            start = ln.find('[', start + 1, endpos)
 
-        result = result + ln
 
-    return result
+# Time budget of a line, see set_line_time_budget()
+class _LineTimeBudgetExceeded(Exception):
+    pass
+
+
+# Time by which the line being standarized has to be done, None without a budget
+def _line_deadline() -> Optional[float]:
+    if _line_time_budget is None:
+        return None
+
+    return time.perf_counter() + _line_time_budget
+
+
+# Set how long a single line can take to standarize
+def set_line_time_budget(seconds: Optional[float] = 1.0):
+    """
+    Lines that take longer than this are left as they are, so one bad note can't stall a whole vault run. Link
+    scanning is linear in the length of the line, the deadline is checked every 32 '[' while scanning and after every
+    link conversion, so a slow wikilink resolver overruns it by one call at most.
+
+    :float seconds: Seconds per line, None for no budget
+    """
+    global _line_time_budget
+
+    _line_time_budget = seconds
 
 
 # Split markdown INTERNAL links
@@ -193,45 +1308,22 @@ def multiline_anylink_standarize(lines: str) -> str:
 # 'Path'
 # 'Filename'
 def internal_mdlink_split(mdlink: str) -> Union[dict, bool]:
-    # Regex pattern to split markdown internal links in it's parts
-    regex = re.compile(r"""
-        ^           # Line begin anchor
-        (!)?        # 1 Optional Embedded
-        \[(.*)]    # 2 Optional Title
-        \((.*/)?    # 3 Optional path
-        (.*)\)      # 4 Filename
-        $           # Line end anchor
-        """, re.X)
-
-    search = regex.search(mdlink)
+    record = _parse_mdlink(mdlink)
 
     # If regex pattern matches the input string
-    if search:
-
-        mdlink_dictionary = {
-            'Embedded': search.group(1),
-            'Title': search.group(2),
-            'Path': search.group(3),
-            'Filename': search.group(4)
-        }
-
-        # Clean optional components
-        if not mdlink_dictionary['Embedded']:
-            mdlink_dictionary['Embedded'] = ''
-
-        if not mdlink_dictionary['Title']:
-            mdlink_dictionary['Title'] = ''
-
-        if not mdlink_dictionary['Path']:
-            mdlink_dictionary['Path'] = ''
-
-        return mdlink_dictionary
+    if record:
+        return record.as_dictionary(split_url=False)
 
     # mdlink was not detected on the input string
     else:
         return False
 
 
+# Check if a path starts with an url scheme, i.e. https: or otherurl:
+def _has_url_scheme(path: str) -> bool:
+    return _URL_SCHEME_REGEX.match(path) is not None
+
+
 # Return if the string is a link, and which type
 def link_type(string: str) -> Union[str, bool]:
     """
@@ -247,32 +1339,262 @@ def link_type(string: str) -> Union[str, bool]:
 
     :return: returns link type
     """
-    # First check if it is an internal link or url link
-    mdlink_dictionary = internal_mdlink_split(string)
+    record = parse_link(string)
 
-    if mdlink_dictionary:
-        url_split = urllib.parse.urlparse(mdlink_dictionary['Path'])
+    return record and record.link_type
 
-        if url_split.scheme != '':
-            return 'urlmdlink'
-        else:
-            # See if title is a wikilink
-            if not wikilink_split('[' + mdlink_dictionary['Title'] + ']'):
-                return 'internalmdlink'
-            else:
-                return 'standardizedmdlink'
+
+# Single pass classifier shared by link_type() and the converters
+def parse_link(string: str) -> Union[MdLink, WikiLink, AnchorLink, bool]:
+    """
+    Analyze the string and return the parsed link, so callers don't have to split it again. The record link_type
+    is the same link_type() returns.
+
+    :string string: Expects a link from a markdown file
+
+    :return: returns a MdLink, WikiLink or AnchorLink record, or False if no link is detected
+    """
+    # First check if it is an internal link or url link
+    record = _parse_mdlink(string)
+
+    if record:
+        return record
 
     # Not mdlink. Check if it's wikilink
+    record = _parse_wikilink(string)
+
+    if record:
+        return record
+
+    # Check if its an ahref link
+    return _parse_first_anchor(string)
+
+
+# Parse the string as a whole markdown link: optional '!', '[' title '](' optional path ending in '/', filename ')'.
+# A single trailing newline is allowed, no other
+def _parse_mdlink(string: str) -> Union[MdLink, bool]:
+    end = len(string) - 1 if string.endswith('\n') else len(string)
+    title_start = 2 if string.startswith('!') else 1
+
+    if (end < title_start + 3 or string[title_start - 1] != '[' or string[end - 1] != ')' or
+            string.find('\n', 0, end) >= 0):
+        return False
+
+    # The title runs up to the last '](' that leaves room for the closing ')'
+    title_end = string.rfind('](', title_start, end - 1)
+    if title_end < 0:
+        return False
+
+    filename_end = end - 1
+    # The path runs up to the last '/'
+    path_start = title_end + 2
+    filename_start = string.rfind('/', path_start, filename_end) + 1 or path_start
+
+    if _has_url_scheme(string[path_start:filename_start]):
+        linktype = 'urlmdlink'
+    # See if title is a wikilink. Search '[' + Title + ']' in place: the title is always enclosed in brackets
+    elif _find_wikilink(string, title_start - 1, title_end + 1):
+        linktype = 'standardizedmdlink'
     else:
-        wikilink_dictionary = wikilink_split(string)
+        linktype = 'internalmdlink'
 
-        if wikilink_dictionary:
-            return 'wikilink'
-        else:
-            # Check if its an ahref link
-            soup = BeautifulSoup(string, 'html.parser')
+    return MdLink(string, linktype, 0, end, title_start, title_end, path_start, filename_start, filename_end)
+
+
+# Find the first wikilink in the string
+def _parse_wikilink(string: str) -> Union[WikiLink, bool]:
+    span = _find_wikilink(string, 0, len(string))
+
+    if not span:
+        return False
+
+    return WikiLink(string, *span)
+
+
+# Span of the first '[[' ... ']]' in string[pos:endpos] with no newline inside, or None
+def _find_wikilink(string: str, pos: int, endpos: int) -> Optional[Tuple[int, int]]:
+    start = string.find('[[', pos, endpos)
+
+    while start >= 0:
+        end = string.find(']]', start + 2, endpos)
+        if end < 0:
+            return None
 
-            if soup.find('a'):
-                return 'ahreflink'
+        newline = string.find('\n', start + 2, end)
+        if newline < 0:
+            return start, end + 2
+
+        # No '[[' before the newline can be closed either
+        start = string.find('[[', newline, endpos)
+
+    return None
+
+
+# Whether a '[' is followed by a ']' in the same line, i.e. a title already double-bracketed
+def _has_bracketed_text(string: str) -> bool:
+    start = string.find('[')
+
+    while start >= 0:
+        end = string.find(']', start + 1)
+        if end < 0:
+            return False
+
+        newline = string.find('\n', start + 1, end)
+        if newline < 0:
+            return True
+
+        start = string.find('[', newline)
 
     return False
+
+
+# Filename with an extension
+def _has_extension(filename: str) -> bool:
+    return '.' in filename
+
+
+# Standarize a note from stdin to stdout. Bytes are read and written as they are, so line endings and the rest of
+# the note come out exactly the same
+def standarize_stdio(stdin=None, stdout=None) -> int:
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+
+    data = stdin.read()
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Not a note it can read, passed through unchanged
+        print(f"-: {e}", file=sys.stderr)
+        stdout.write(data)
+        stdout.flush()
+        return 1
+
+    stdout.write(multiline_anylink_standarize(text).encode('utf-8'))
+    stdout.flush()
+    return 0
+
+
+# Command line: python -m link_standarizer path/to/vault, or - to standarize a note from stdin to stdout
+def main(argv=None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # Editor hooks run it on every saved note: a lone '-' doesn't even import argparse
+    if list(argv) == ['-']:
+        return standarize_stdio()
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m link_standarizer',
+                                     description='Standarize the links of every .md file in a vault.')
+    parser.add_argument('vault', help='directory with the markdown notes, walked recursively, a single large file '
+                                      'to standarize in chunks, or - to standarize a note from stdin to stdout')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU, 1 runs in this process)')
+    parser.add_argument('--chunksize', type=int, default=8, help='files handed to a worker at a time (default: 8)')
+    parser.add_argument('--chunk-mb', type=int, default=8,
+                        help='MB of a single large file handed to a worker at a time (default: 8)')
+    parser.add_argument('--unordered', action='store_true',
+                        help='report files as they finish instead of in walk order')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every changed file')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='skip notes unchanged since the last incremental run')
+    parser.add_argument('--manifest', default=None,
+                        help='manifest for --incremental (default: .link_standarizer_manifest.json in the vault)')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='cache this many link conversions per worker (default: 0, no cache)')
+    parser.add_argument('--resolve-wikilinks', action='store_true',
+                        help='link wikilinks to the path of the note they point to, instead of the bare name')
+    parser.add_argument('--stats', metavar='PATH', default=None,
+                        help='count links by type, time every phase and save it all as JSON')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="don't write any file, list the notes whose links would change")
+    parser.add_argument('--diff', action='store_true', help="don't write any file, print a diff of the changes")
+    parser.add_argument('--check', action='store_true',
+                        help="don't standarize, list the links to files that don't exist (-j sets the threads)")
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, standarize the notes seconds after they are saved')
+    parser.add_argument('--debounce', type=float, default=2.0,
+                        help='with --watch, seconds a note must go unchanged before it is standarized (default: 2)')
+    parser.add_argument('--rename', nargs=2, metavar=('OLD', 'NEW'),
+                        help="don't standarize, move the note OLD to NEW and rewrite the links to it, using the "
+                             "vault link index")
+    args = parser.parse_args(argv)
+
+    if args.vault == '-':
+        return standarize_stdio()
+
+    # A single file is standarized in chunks, these only work on a vault
+    if os.path.isfile(args.vault):
+        vault_options = [option for option, value in (('--diff', args.diff), ('--check', args.check),
+                                                      ('--watch', args.watch), ('--rename', args.rename),
+                                                      ('--incremental', args.incremental),
+                                                      ('--manifest', args.manifest), ('--stats', args.stats),
+                                                      ('--cache-size', args.cache_size),
+                                                      ('--resolve-wikilinks', args.resolve_wikilinks),
+                                                      ('--unordered', args.unordered)) if value]
+        if vault_options:
+            parser.error(f"{', '.join(vault_options)} can't be used with a single file, only with a vault")
+
+    if args.watch:
+        import vault_watcher
+
+        print(f"Watching {args.vault}, Ctrl+C to stop")
+        vault_watcher.watch_vault(args.vault, debounce=args.debounce, workers=args.workers,
+                                  resolve_wikilinks=args.resolve_wikilinks)
+
+        return 0
+
+    if args.rename:
+        import link_index
+
+        with link_index.LinkIndex(args.vault) as index:
+            index.update()
+            written = index.rename(*args.rename)
+        for path, links in written.items():
+            print(f"{path}: {links} links rewritten")
+        print(f"{len(written)} notes rewritten")
+
+        return 0
+
+    if args.check:
+        import link_checker
+
+        checker = link_checker.LinkChecker(args.vault, workers=args.workers)
+        broken = checker.check()
+        for link in broken:
+            print(link_checker.format_broken_link(link))
+        for path, error in checker.errors.items():
+            print(f"{path}: {error}", file=sys.stderr)
+        print(f"{len(broken)} broken links")
+
+        return 1 if broken or checker.errors else 0
+
+    import vault_standarizer
+
+    if os.path.isfile(args.vault):
+        result = vault_standarizer.standarize_large_file(args.vault, workers=args.workers,
+                                                         chunk_size=args.chunk_mb * 1024 * 1024,
+                                                         dry_run=args.dry_run)
+        print(f"{result.path}: {result.links_changed} links changed" + (', nothing written' if args.dry_run else ''))
+        return 0
+
+    summary = vault_standarizer.standarize_vault(args.vault, workers=args.workers, chunksize=args.chunksize,
+                                                 ordered=not args.unordered,
+                                                 verbose=args.verbose or args.dry_run,
+                                                 incremental=args.incremental, manifest_path=args.manifest,
+                                                 cache_size=args.cache_size or None, instrument=bool(args.stats),
+                                                 resolve_wikilinks=args.resolve_wikilinks,
+                                                 dry_run=args.dry_run, diff=args.diff)
+    print(vault_standarizer.format_summary(summary) + (', nothing written' if args.dry_run or args.diff else ''))
+
+    if args.stats:
+        stats = dict(summary.instrumentation or {})
+        stats['Summary'] = summary._replace(instrumentation=None)._asdict()
+        dump_instrumentation(args.stats, stats)
+
+    return 1 if summary.files_failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
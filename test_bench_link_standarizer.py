@@ -0,0 +1,48 @@
+import os
+import random
+import tempfile
+import unittest
+
+import bench_link_standarizer
+import link_standarizer
+
+
+class TestSyntheticVault(unittest.TestCase):
+    def test_generate_link(self):
+        rng = random.Random(0)
+        expected = {
+            'wikilink': 'wikilink',
+            'embeddedimage': 'internalmdlink',
+            'internalmdlink': 'internalmdlink',
+            'urlmdlink': 'urlmdlink',
+            'ahreflink': 'ahreflink'
+        }
+
+        for kind in bench_link_standarizer.LINK_KINDS:
+            for _ in range(20):
+                link = bench_link_standarizer.generate_link(rng, kind)
+                self.assertEqual(link_standarizer.link_type(link), expected[kind], link)
+
+    def test_generate_note(self):
+        note = bench_link_standarizer.generate_note(random.Random(1), lines=200, link_density=2, mix={'wikilink': 1})
+        self.assertEqual(note.count('\n'), 200)
+        self.assertEqual(note.count('[['), 400)
+
+        # Same seed, same note
+        self.assertEqual(note, bench_link_standarizer.generate_note(random.Random(1), lines=200, link_density=2,
+                                                                    mix={'wikilink': 1}))
+
+    def test_generate_vault(self):
+        with tempfile.TemporaryDirectory() as vault:
+            paths = bench_link_standarizer.generate_vault(vault, notes=7, folders=3, lines=5)
+            self.assertEqual(len(paths), 7)
+            self.assertEqual(sorted(os.listdir(vault)), ['folder0', 'folder1', 'folder2'])
+
+    def test_compare(self):
+        baseline = {'results': {'a': 1.0, 'b': 1.0, 'c': 1.0}}
+        current = {'results': {'a': 1.05, 'b': 1.5, 'c': 0.5, 'new': 3.0}}
+        self.assertEqual(bench_link_standarizer.compare(baseline, current, threshold=0.1), {'b': 1.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import link_checker
+import link_standarizer
+from link_index import IndexedLink
+from test_vault_standarizer import write_note
+
+
+class TestLinkChecker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vault = self.tmp.name
+        write_note(self.vault, 'Index.md', "[[Some Note]] [[Missing]] [[Some Note#Heading]] [[#Heading]]\n"
+                                           "[a](projects/Some%20Note.md) [b](projects/Gone.md) [c](#top)\n"
+                                           "`[[In code]]` [site](https://go.to/missing)\n")
+        write_note(self.vault, 'projects/Some Note.md', "![[image.png]] [[../Index]](../Index.md) "
+                                                        "![](/projects/Gone.md) [d](.hidden/x.md)\n")
+        write_note(self.vault, 'projects/.hidden/x.md', "")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_check(self):
+        checker = link_checker.LinkChecker(self.vault, workers=4)
+        self.assertEqual(checker.check(), [
+            IndexedLink('Index.md', 1, 14, 25, 'wikilink', 'Missing.md'),
+            IndexedLink('Index.md', 2, 29, 50, 'internalmdlink', 'projects/Gone.md'),
+            IndexedLink('projects/Some Note.md', 1, 0, 14, 'wikilink', 'image.png'),
+            IndexedLink('projects/Some Note.md', 1, 41, 63, 'internalmdlink', 'projects/Gone.md'),
+        ])
+
+        # Targets out of the file index were stat'ed once, and cached
+        self.assertEqual(checker._stat_cache, {'projects/Gone.md': False, 'projects/.hidden/x.md': True})
+
+        write_note(self.vault, 'projects/Gone.md', "")
+        self.assertEqual(len(checker.check()), 4)
+        checker.clear_cache()
+        self.assertEqual(len(checker.check()), 2)
+
+    def test_undecodable_note(self):
+        with open(os.path.join(self.vault, 'Bad.md'), 'wb') as f:
+            f.write("[[Caf\u00e9]]\n".encode('latin-1'))
+
+        checker = link_checker.LinkChecker(self.vault)
+        self.assertEqual(len(checker.check()), 4)
+        self.assertEqual(list(checker.errors), ['Bad.md'])
+
+    def test_main_check(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(link_standarizer.main([self.vault, '--check']), 1)
+
+        self.assertEqual(output.getvalue().splitlines()[:2], ["Index.md:1:15: wikilink Missing.md",
+                                                              "Index.md:2:30: internalmdlink projects/Gone.md"])
+
+
+if __name__ == '__main__':
+    unittest.main()
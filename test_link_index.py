@@ -0,0 +1,234 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+
+import link_index
+import link_standarizer
+from test_vault_standarizer import read_note, write_note
+
+
+class TestNormalizeTarget(unittest.TestCase):
+    def test_normalize_target(self):
+        record = link_standarizer.parse_link("[[Some Note]]")
+        self.assertEqual(link_index.normalize_target(record, 'projects/a.md'), 'Some Note.md')
+
+        record = link_standarizer.parse_link("![[image file.png]]")
+        self.assertEqual(link_index.normalize_target(record, 'projects/a.md'), 'image file.png')
+
+        record = link_standarizer.parse_link("[[Some Note]](../Some%20Note.md)")
+        self.assertEqual(link_index.normalize_target(record, 'projects/a.md'), 'Some Note.md')
+
+        record = link_standarizer.parse_link("![](/img/some%20image.png)")
+        self.assertEqual(link_index.normalize_target(record, 'projects/a.md'), 'img/some image.png')
+
+        record = link_standarizer.parse_link("[title](other.md#Heading)")
+        self.assertEqual(link_index.normalize_target(record, 'projects/a.md'), 'projects/other.md')
+
+        record = link_standarizer.parse_link("[Somefile link](https://go.to/somefile.html)")
+        self.assertEqual(link_index.normalize_target(record, 'projects/a.md'), 'https://go.to/somefile.html')
+
+
+class TestLinkIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vault = self.tmp.name
+        write_note(self.vault, 'Index.md', "See [[Some Note]]\nand [other](projects/2020/Some%20Note.md)\n")
+        write_note(self.vault, 'projects/2020/Some Note.md', "Back to [[Index]](../../Index.md) and "
+                                                             "[site](https://go.to/)\n")
+        self.index = link_index.LinkIndex(self.vault)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_links_and_backlinks(self):
+        self.assertEqual(self.index.update(), (2, 0))
+
+        self.assertEqual(self.index.links_from('projects/2020/Some Note.md'), [
+            link_index.IndexedLink('projects/2020/Some Note.md', 1, 8, 33, 'standardizedmdlink', 'Index.md'),
+            link_index.IndexedLink('projects/2020/Some Note.md', 1, 38, 60, 'urlmdlink', 'https://go.to/'),
+        ])
+
+        # Wikilinks are matched by name, md links by path
+        self.assertEqual(self.index.backlinks('projects/2020/Some Note.md'), [
+            link_index.IndexedLink('Index.md', 1, 4, 17, 'wikilink', 'Some Note.md'),
+            link_index.IndexedLink('Index.md', 2, 4, 41, 'internalmdlink', 'projects/2020/Some Note.md'),
+        ])
+        self.assertEqual([link.source for link in self.index.backlinks(os.path.join(self.vault, 'Index.md'))],
+                         ['projects/2020/Some Note.md'])
+
+    def test_incremental_update(self):
+        self.index.update()
+        self.assertEqual(self.index.update(), (0, 0))
+
+        # Edited, added and deleted notes
+        path = write_note(self.vault, 'Index.md', "No links anymore\n")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        write_note(self.vault, 'New.md', "[[Index]]\n")
+        os.remove(os.path.join(self.vault, 'projects/2020/Some Note.md'))
+
+        self.assertEqual(self.index.update(), (2, 1))
+        self.assertEqual(self.index.files(), ['Index.md', 'New.md'])
+        self.assertEqual(self.index.backlinks('projects/2020/Some Note.md'), [])
+        self.assertEqual([link.source for link in self.index.backlinks('Index.md')], ['New.md'])
+
+    def test_update_file(self):
+        self.index.update()
+
+        write_note(self.vault, 'Index.md', "[[Elsewhere]]\n")
+        self.index.update_file('Index.md')
+        self.assertEqual([link.target for link in self.index.links_from('Index.md')], ['Elsewhere.md'])
+
+        self.index.remove_file('Index.md')
+        self.assertEqual(self.index.files(), ['projects/2020/Some Note.md'])
+
+    def test_undecodable_note(self):
+        with open(os.path.join(self.vault, 'Bad.md'), 'wb') as f:
+            f.write("[[Caf\u00e9]]\n".encode('latin-1'))
+
+        self.assertEqual(self.index.update(), (3, 0))
+        self.assertEqual(self.index.links_from('Bad.md'), [])
+        self.assertEqual(len(self.index.links_from('Index.md')), 2)
+
+    def test_persistent(self):
+        self.index.update()
+        self.index.close()
+
+        self.index = link_index.LinkIndex(self.vault)
+        self.assertEqual(self.index.update(), (0, 0))
+        self.assertEqual(len(self.index.backlinks('Index.md')), 1)
+
+
+class TestRename(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vault = self.tmp.name
+        self.index_note = write_note(self.vault, 'Index.md',
+                                     "See [[Some Note]] and [[Some Note|alias]] and ![[Some Note#Part]]\n"
+                                     "[[Some Note]](Some%20Note.md) [other](projects/2020/Some%20Note.md#top)\n"
+                                     "[[Some Note.md]](projects/2020/Some%20Note.md) `[[Some Note]]` [[Other]]\n")
+        write_note(self.vault, 'projects/2020/Some Note.md', "Back to [[Index]](../../Index.md), [me](Some%20Note.md) "
+                                                             "and [site](https://go.to/)\n")
+        # Same name, its own folder's note wins for its wikilinks
+        write_note(self.vault, 'archive/old/2019/Some Note.md', "")
+        write_note(self.vault, 'archive/old/2019/Ref.md', "[[Some Note]]\n")
+        self.untouched = write_note(self.vault, 'Untouched.md', "[[Index]]\n")
+        self.index = link_index.LinkIndex(self.vault)
+        self.index.update()
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_rename(self):
+        mtime_ns = os.stat(self.untouched).st_mtime_ns
+
+        self.assertEqual(self.index.rename('projects/2020/Some Note.md', 'notes/Renamed.md'),
+                         {'notes/Renamed.md': 2, 'Index.md': 6})
+
+        self.assertFalse(os.path.exists(os.path.join(self.vault, 'projects/2020/Some Note.md')))
+        self.assertEqual(read_note(os.path.join(self.vault, 'notes/Renamed.md')),
+                         "Back to [[Index]](../Index.md), [me](Renamed.md) and [site](https://go.to/)\n")
+        self.assertEqual(read_note(self.index_note),
+                         "See [[Renamed]] and [[Renamed|alias]] and ![[Renamed#Part]]\n"
+                         "[[Renamed]](Renamed.md) [other](notes/Renamed.md#top)\n"
+                         "[[Renamed.md]](notes/Renamed.md) `[[Some Note]]` [[Other]]\n")
+        self.assertEqual(read_note(os.path.join(self.vault, 'archive/old/2019/Ref.md')), "[[Some Note]]\n")
+        self.assertEqual(os.stat(self.untouched).st_mtime_ns, mtime_ns)
+
+        # The index follows
+        self.assertEqual(self.index.update(), (0, 0))
+        self.assertEqual(len(self.index.backlinks('notes/Renamed.md')), 6)
+        self.assertEqual(self.index.links_from('notes/Renamed.md')[0].target, 'Index.md')
+
+    def test_rename_to_a_shared_name(self):
+        # Another note has the new name, wikilinks get the path
+        self.index.rename('projects/2020/Some Note.md', 'projects/Ref.md')
+        self.assertTrue(read_note(self.index_note).startswith("See [[projects/Ref]] and [[projects/Ref|alias]]"))
+
+    def test_main_rename(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(link_standarizer.main([self.vault, '--rename', 'projects/2020/Some Note.md',
+                                                    'Renamed.md']), 0)
+        self.assertTrue(read_note(self.index_note).startswith("See [[Renamed]]"))
+
+    def test_rename_errors(self):
+        with self.assertRaises(FileExistsError):
+            self.index.rename('projects/2020/Some Note.md', 'Untouched.md')
+        with self.assertRaises(FileNotFoundError):
+            self.index.rename('Missing.md', 'Other.md')
+
+    def test_stale_note(self):
+        # Edited since it was indexed, the spans are found again
+        path = write_note(self.vault, 'Index.md', "Moved down\n[[Some Note]]\n")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+
+        self.index.rename('projects/2020/Some Note.md', 'Renamed.md')
+        self.assertEqual(read_note(path), "Moved down\n[[Renamed]]\n")
+
+
+class TestFilenameIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vault = self.tmp.name
+        for path in ('Index.md', 'projects/2020/Some Note.md', 'projects/other.md', 'projects/2020/other.md',
+                     'img/a b.png', '.obsidian/workspace.md'):
+            write_note(self.vault, path, '')
+        self.index = link_index.FilenameIndex(self.vault, partial=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resolve(self):
+        self.assertEqual(len(self.index), 5)
+
+        # Case-insensitive, '.md' is optional, aliases are ignored
+        self.assertEqual(self.index.resolve('some note'), 'projects/2020/Some Note.md')
+        self.assertEqual(self.index.resolve('Some Note|the note'), 'projects/2020/Some Note.md')
+        self.assertEqual(self.index.resolve('a b.png'), 'img/a b.png')
+
+        # Relative to the source note
+        self.assertEqual(self.index.resolve('Some Note', 'projects/x.md'), '2020/Some Note.md')
+        self.assertEqual(self.index.resolve('a b.png', 'projects/x.md'), '../img/a b.png')
+
+        # Same name: the one in the source folder wins, else the shortest path. Paths tell them apart
+        self.assertEqual(self.index.resolve('other'), 'projects/other.md')
+        self.assertEqual(self.index.resolve('other', 'projects/2020/Some Note.md'), 'other.md')
+        self.assertEqual(self.index.resolve('2020/other'), 'projects/2020/other.md')
+        self.assertEqual(self.index.resolve('projects/2020/other.md'), 'projects/2020/other.md')
+
+        # Unknown, headings and hidden files fall back to the bare name
+        self.assertEqual(self.index.resolve('missing'), None)
+        self.assertEqual(self.index.resolve('Some Note#Heading'), None)
+        self.assertEqual(self.index.resolve('workspace'), None)
+
+    def test_partial_names(self):
+        self.assertEqual(self.index.complete('OTH'), ['projects/2020/other.md', 'projects/other.md'])
+        self.assertEqual(self.index.resolve('Some N'), 'projects/2020/Some Note.md')
+        # Ambiguous
+        self.assertEqual(self.index.resolve('oth'), None)
+
+        with self.assertRaises(ValueError):
+            link_index.FilenameIndex(self.vault).complete('oth')
+
+    def test_refresh(self):
+        write_note(self.vault, 'New Note.md', '')
+        os.remove(os.path.join(self.vault, 'projects/other.md'))
+
+        self.assertEqual(self.index.refresh(), (1, 1))
+        self.assertEqual(self.index.resolve('new note'), 'New Note.md')
+        self.assertEqual(self.index.resolve('other'), 'projects/2020/other.md')
+        self.assertEqual(self.index.complete('new'), ['New Note.md'])
+        self.assertEqual(self.index.refresh(), (0, 0))
+
+    def test_resolver(self):
+        resolver = self.index.resolver(os.path.join(self.vault, 'projects', 'x.md'))
+        result = link_standarizer.multiline_anylink_standarize("[[Some Note]] ![[a b.png]] [[nope]]", resolver)
+        self.assertEqual(result, "[[Some Note]](2020/Some%20Note.md) ![[a b.png]](../img/a%20b.png) [[nope]](nope.md)")
+
+
+if __name__ == '__main__':
+    unittest.main()
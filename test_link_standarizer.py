@@ -1,4 +1,16 @@
+import contextlib
+import io
+import os
+import pickle
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+import urllib.parse
+import bench_link_standarizer
 import link_standarizer
 
 
@@ -8,6 +20,17 @@ class TestWikiLinkToMdlink(unittest.TestCase):
         self.assertEqual(result, "[[MD File]](MD%20File.md)")
 
 
+class TestResolvedWikiLinkToMdlink(unittest.TestCase):
+    def test_wikilink_to_mdlink(self):
+        resolver = {'MD File': 'projects/MD File.md'}.get
+        result = link_standarizer.wikilink_to_mdlink("[[MD File]]", resolver)
+        self.assertEqual(result, "[[MD File]](projects/MD%20File.md)")
+
+        # Not resolved: bare name
+        result = link_standarizer.wikilink_to_mdlink("[[Other File]]", resolver)
+        self.assertEqual(result, "[[Other File]](Other%20File.md)")
+
+
 class TestEmbeddedImageWikiLinkToMdlink(unittest.TestCase):
     def test_wikilink_to_mdlink(self):
         result = link_standarizer.wikilink_to_mdlink("![[image file.png]]")
@@ -177,6 +200,57 @@ class TestLinkType(unittest.TestCase):
         result = link_standarizer.link_type("This does *not* have any links here")
         self.assertEqual(result, False)
 
+        # Schemes must start with a letter, like urllib.parse.urlparse() expects
+        result = link_standarizer.link_type("[A note](1otherurl://somenote.com/some%20file.md)")
+        self.assertEqual(result, 'internalmdlink')
+
+        result = link_standarizer.link_type("[A note]( otherurl://somenote.com/some%20file.md)")
+        self.assertEqual(result, 'urlmdlink')
+
+        # Wikilink title inside a md link makes it standardized, not a wikilink
+        result = link_standarizer.link_type("[[A note]] and [b](c.md)")
+        self.assertEqual(result, 'standardizedmdlink')
+
+
+class TestParseLink(unittest.TestCase):
+    def test_parse_link(self):
+        result = link_standarizer.parse_link("![optional title](/path/to/some%20image.png)")
+        self.assertIsInstance(result, link_standarizer.MdLink)
+        self.assertEqual(result.link_type, 'internalmdlink')
+        self.assertEqual((result.embedded, result.title, result.path, result.filename, result.url),
+                         ('!', 'optional title', '/path/to/', 'some%20image.png', None))
+
+        # Spans point into the source string
+        self.assertEqual(result.source[result.title_start:result.title_end], 'optional title')
+
+        result = link_standarizer.parse_link("[Somefile link](https://go.to/somefile.html)")
+        self.assertEqual((result.link_type, result.url), ('urlmdlink', 'https://go.to/somefile.html'))
+
+        result = link_standarizer.parse_link("Some text ![[image file.png]] here")
+        self.assertIsInstance(result, link_standarizer.WikiLink)
+        self.assertEqual((result.link_type, result.target, result.start, result.end),
+                         ('wikilink', 'image file.png', 11, 29))
+
+        result = link_standarizer.parse_link("text\n<a class='x' href='url'>title</a>")
+        self.assertIsInstance(result, link_standarizer.AnchorLink)
+        self.assertEqual((result.link_type, result.start, result.title, result.url, result.classes),
+                         ('ahreflink', 5, 'title', 'url', ('x',)))
+
+        result = link_standarizer.parse_link("This does *not* have any links here")
+        self.assertEqual(result, False)
+
+    def test_link_records_are_immutable(self):
+        result = link_standarizer.parse_link("[[MD File]]")
+
+        with self.assertRaises(AttributeError):
+            result.start = 0
+
+        with self.assertRaises(AttributeError):
+            result.other = 0
+
+        self.assertEqual(result, link_standarizer.parse_link("[[MD File]]"))
+        self.assertEqual(pickle.loads(pickle.dumps(result)), result)
+
 
 class TestAnyLinkToStandarizedLink(unittest.TestCase):
     def test_anylink_to_standarizedmdlink(self):
@@ -255,11 +329,40 @@ class TestMultilineStandarizer(unittest.TestCase):
         self.assertEqual(result, "![[MD File]](path/to/MD%20File.md)\n![[some image.png]](some%20image.png)\n![[some image.png]](/path/to/some%20image.png)")
 
         # Other links that shouldn't be converted ----------------------------------
-        # result = link_standarizer.multiline_anylink_standarize("[A note](https://somenote.com/some%20file.md)")
-        # self.assertEqual(result, "[A note](https://somenote.com/some%20file.md)")
+        result = link_standarizer.multiline_anylink_standarize("[A note](https://somenote.com/some%20file.md)")
+        self.assertEqual(result, "[A note](https://somenote.com/some%20file.md)")
+
+        result = link_standarizer.multiline_anylink_standarize("[A note](otherurl://somenote.com/some%20file.md)")
+        self.assertEqual(result, "[A note](otherurl://somenote.com/some%20file.md)")
+
+        # Links after one that changed length are still found at the right place
+        result = link_standarizer.multiline_anylink_standarize("[[a b]] then [x](https://x.org/) and ![](c d.png)\n")
+        self.assertEqual(result, "[[a b]](a%20b.md) then [x](https://x.org/) and ![[c d.png]](c%20d.png)\n")
+
+
+class TestMultilineFastReject(unittest.TestCase):
+    def test_multiline_anylink_standarize(self):
+        # Prose without link syntax comes back as the very same string
+        text = "Just prose.\nNo links here (at all).\n" * 100
+        self.assertIs(link_standarizer.multiline_anylink_standarize(text), text)
 
-        # result = link_standarizer.multiline_anylink_standarize("[A note](otherurl://somenote.com/some%20file.md)")
-        # self.assertEqual(result, "[A note](otherurl://somenote.com/some%20file.md)")
+        # Only the lines with links change, whatever the line endings
+        text = "prose\r\n[[A]]\rmore prose\x0b![](b c.png)\n" + "prose\n" * 10 + "[[D]] end"
+        result = link_standarizer.multiline_anylink_standarize(text)
+        self.assertEqual(result, "prose\r\n[[A]](A.md)\rmore prose\x0b![[b c.png]](b%20c.png)\n" + "prose\n" * 10 +
+                         "[[D]](D.md) end")
+
+
+class TestStreamStandarizer(unittest.TestCase):
+    def test_stream_anylink_standarize(self):
+        lines = ["Some text [[MD File]]\n", "no links\n", "![](some image.png)"]
+        result = link_standarizer.stream_anylink_standarize(lines)
+        self.assertEqual(list(result), ["Some text [[MD File]](MD%20File.md)\n", "no links\n",
+                                        "![[some image.png]](some%20image.png)"])
+
+        # Text file objects are iterables of lines too
+        result = link_standarizer.stream_anylink_standarize(io.StringIO("[[A]]\r\n[[B]]\n"))
+        self.assertEqual("".join(result), "[[A]](A.md)\r\n[[B]](B.md)\n")
 
 class TestMultiLinkInLineStandarizer(unittest.TestCase):
     def test_multilinkinline_anylink_standarize(self):
@@ -274,6 +377,322 @@ class TestMultiLinkInLineAndMultilineStandarizer(unittest.TestCase):
         ![[some image.png]](/path/to/some%20image.png)""")
 
 
+class TestCodeAwareStandarizer(unittest.TestCase):
+    def test_code_is_left_as_is(self):
+        text = ("[[A]] and `[[inline]]` then ``a ` [[B]]``\n"
+                "\n"
+                "```python\n"
+                "links = '[[fenced]]'\n"
+                "```\n"
+                "~~~~\n"
+                "[[tilde]]\n"
+                "~~~\n"
+                "~~~~\n"
+                "\n"
+                "    [[indented]]\n"
+                "\n"
+                "[[C]] `unclosed [[D]]\n")
+        self.assertEqual(link_standarizer.multiline_anylink_standarize(text),
+                         "[[A]](A.md) and `[[inline]]` then ``a ` [[B]]``\n"
+                         "\n"
+                         "```python\n"
+                         "links = '[[fenced]]'\n"
+                         "```\n"
+                         "~~~~\n"
+                         "[[tilde]]\n"
+                         "~~~\n"
+                         "~~~~\n"
+                         "\n"
+                         "    [[indented]]\n"
+                         "\n"
+                         "[[C]](C.md) `unclosed [[D]](D.md)\n")
+        self.assertEqual("".join(link_standarizer.stream_anylink_standarize(text)),
+                         link_standarizer.multiline_anylink_standarize(text))
+        self.assertEqual([(line, start, end) for line, start, end, _ in link_standarizer.iter_links(text)],
+                         [(1, 0, 5), (13, 0, 5), (13, 16, 21)])
+
+    def test_indented_prose(self):
+        # Indented lines that continue a paragraph or a list item are prose
+        text = "Some text\n    [[A]]\n\n- item\n\n    [[B]]\n"
+        self.assertEqual(link_standarizer.multiline_anylink_standarize(text),
+                         "Some text\n    [[A]](A.md)\n\n- item\n\n    [[B]](B.md)\n")
+
+    def test_skip_code_off(self):
+        self.assertEqual(link_standarizer.multiline_anylink_standarize("`[[A]]`", skip_code=False), "`[[A]](A.md)`")
+
+    def test_indented_code_after_any_line_separator(self):
+        for separator in ('\n', '\r', '\r\n', '\v', '\f', '\x1c', '\x85', '\u2028'):
+            text = f"[[A]]{separator}{separator}    [[B]]\n"
+            self.assertTrue(link_standarizer._may_hold_code(text), repr(separator))
+            self.assertEqual(link_standarizer.multiline_anylink_standarize(text),
+                             f"[[A]](A.md){separator}{separator}    [[B]]\n", repr(separator))
+
+        self.assertTrue(link_standarizer._may_hold_code("\t[[B]]"))
+        self.assertFalse(link_standarizer._may_hold_code("[[A]]   and\n   [[B]] ~~ \u00a0   "))
+
+
+class TestPathologicalLines(unittest.TestCase):
+    # The regexes the link scanners replaced, they must find the same links
+    STANDARIZABLE_LINK_REGEX = re.compile(r"(!?\[{1,2}[^]]*?]{1,2}\(.*?\)|!?\[{2}.*?]{2}(?!\())")
+    MDLINK_REGEX = re.compile(r"^(!)?\[(.*)]\((.*/)?(.*)\)$")
+
+    def tearDown(self):
+        link_standarizer.set_line_time_budget()
+
+    def test_same_links_as_regex(self):
+        rng = random.Random(0)
+        alphabet = ['[', ']', '(', ')', '!', '\n', '/', 'a', ' ', '[[', ']]', '](']
+
+        for _ in range(5000):
+            ln = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+            self.assertEqual(list(link_standarizer._iter_link_spans(ln, 0, len(ln))),
+                             [m.span() for m in self.STANDARIZABLE_LINK_REGEX.finditer(ln)], ln)
+
+            m = self.MDLINK_REGEX.search(ln)
+            record = link_standarizer._parse_mdlink(ln)
+            self.assertEqual(bool(record), m is not None, ln)
+            if m:
+                self.assertEqual((record.title, record.path, record.filename),
+                                 (m.group(2), m.group(3) or '', m.group(4)), ln)
+
+    def test_linear_time(self):
+        # Minutes with the backtracking regexes
+        for ln in bench_link_standarizer.pathological_lines(100000):
+            start = time.perf_counter()
+            link_standarizer.multiline_anylink_standarize(ln)
+            link_standarizer.parse_link(ln)
+            self.assertLess(time.perf_counter() - start, 2, ln[:20])
+
+    def test_line_time_budget(self):
+        ln = "[[A]] " * 100
+        link_standarizer.set_line_time_budget(0)
+        self.assertEqual(link_standarizer.multiline_anylink_standarize(ln), ln)
+        # Links found before the budget ran out are still links
+        self.assertEqual(len(list(link_standarizer.iter_links(ln))), 31)
+
+        link_standarizer.set_line_time_budget(None)
+        self.assertEqual(link_standarizer.multiline_anylink_standarize(ln), "[[A]](A.md) " * 100)
+
+    def test_line_time_budget_slow_resolver(self):
+        # Fewer links than the scanner checks the deadline at, it's the conversions that take the time
+        def resolver(filename):
+            time.sleep(0.1)
+            return None
+
+        ln = "[[A]] " * 20
+        link_standarizer.set_line_time_budget(0.05)
+        start = time.perf_counter()
+        self.assertEqual(link_standarizer.multiline_anylink_standarize(ln, resolver), ln)
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+
+class TestLinkCache(unittest.TestCase):
+    def tearDown(self):
+        link_standarizer.disable_link_cache()
+
+    def test_link_cache(self):
+        self.assertEqual(link_standarizer.link_cache_stats(), False)
+
+        link_standarizer.enable_link_cache(maxsize=2)
+        for link in ["[[A]]", "[[B]]", "[[A]]", "[[C]]", "[[B]]"]:
+            result = link_standarizer.anylink_to_standarizedmdlink(link)
+            self.assertEqual(result, link + "(" + link[2] + ".md)")
+
+        # LRU: [[A]] was used again, so [[B]] was evicted before [[C]] came in
+        stats = link_standarizer.link_cache_stats()
+        self.assertEqual((stats['Hits'], stats['Misses'], stats['Evictions'], stats['Size']), (1, 4, 2, 2))
+
+        # Not a link is cached too
+        self.assertEqual(link_standarizer.anylink_to_standarizedmdlink("no link"), False)
+        self.assertEqual(link_standarizer.anylink_to_standarizedmdlink("no link"), False)
+        self.assertEqual(link_standarizer.link_cache_stats()['Hits'], 2)
+
+        link_standarizer.clear_link_cache()
+        stats = link_standarizer.link_cache_stats()
+        self.assertEqual((stats['Hits'], stats['Misses'], stats['Evictions'], stats['Size']), (0, 0, 0, 0))
+
+    def test_link_cache_fifo(self):
+        link_standarizer.enable_link_cache(maxsize=2, policy='fifo')
+        for link in ["[[A]]", "[[B]]", "[[A]]", "[[C]]", "[[A]]"]:
+            link_standarizer.anylink_to_standarizedmdlink(link)
+
+        # FIFO: [[A]] was the oldest, even if it was used again
+        stats = link_standarizer.link_cache_stats()
+        self.assertEqual((stats['Hits'], stats['Misses'], stats['Evictions']), (1, 4, 2))
+
+        with self.assertRaises(ValueError):
+            link_standarizer.enable_link_cache(policy='random')
+
+
+class TestBatchLinks(unittest.TestCase):
+    LINKS = ["[[Index]]", "![[image file.png]]", "[title](some%20file.md)", "[[Index]](Index.md)",
+             "[site](https://go.to/page.html)", "<a href='https://go.to/'>site</a>", "no link", "[[Index]]",
+             "![[image file.png]]", "[[Index]]"]
+
+    def tearDown(self):
+        link_standarizer.disable_link_cache()
+        link_standarizer.disable_instrumentation()
+
+    def expected(self, links, resolver=None):
+        return [(link_standarizer.link_type(link), link_standarizer.anylink_to_standarizedmdlink(link, resolver))
+                for link in links]
+
+    def test_batch(self):
+        self.assertEqual(link_standarizer.batch_anylink_to_standarizedmdlink(self.LINKS), self.expected(self.LINKS))
+        self.assertEqual(link_standarizer.batch_anylink_to_standarizedmdlink([]), [])
+
+    def test_deduplicated(self):
+        # Every unique link misses the cache once, repeated ones never get to it
+        link_standarizer.enable_link_cache()
+        link_standarizer.batch_anylink_to_standarizedmdlink(self.LINKS)
+
+        stats = link_standarizer.link_cache_stats()
+        self.assertEqual((stats['Hits'], stats['Misses']), (0, len(set(self.LINKS))))
+
+    def test_instrumentation_counts_every_link(self):
+        link_standarizer.enable_instrumentation()
+        link_standarizer.batch_anylink_to_standarizedmdlink(self.LINKS)
+
+        self.assertEqual(link_standarizer.instrumentation_stats()['Links']['wikilink']['Seen'], 5)
+
+    def test_resolver(self):
+        resolver = {'Index': 'notes/Index.md'}.get
+        self.assertEqual(link_standarizer.batch_anylink_to_standarizedmdlink(self.LINKS, resolver),
+                         self.expected(self.LINKS, resolver))
+
+    def test_workers(self):
+        links = [f"[[Note {i % 50}]]" for i in range(200)] + self.LINKS
+        self.assertEqual(link_standarizer.batch_anylink_to_standarizedmdlink(links, workers=2, chunksize=8),
+                         self.expected(links))
+
+
+class TestInstrumentation(unittest.TestCase):
+    def tearDown(self):
+        link_standarizer.disable_instrumentation()
+        link_standarizer.disable_link_cache()
+
+    def test_instrumentation(self):
+        self.assertEqual(link_standarizer.instrumentation_stats(), False)
+
+        calls = []
+        link_standarizer.enable_instrumentation(hook=lambda phase, seconds: calls.append(phase))
+        link_standarizer.multiline_anylink_standarize("[[A]] ![](b c.png) [[C]](C.md) [x](https://x.org/)\n")
+        link_standarizer.anylink_to_standarizedmdlink("<a href='url'>title</a>")
+
+        stats = link_standarizer.instrumentation_stats()
+        self.assertEqual(stats['Links'], {
+            'wikilink': {'Seen': 1, 'Converted': 1, 'Unchanged': 0, 'Rejected': 0},
+            'internalmdlink': {'Seen': 1, 'Converted': 1, 'Unchanged': 0, 'Rejected': 0},
+            'standardizedmdlink': {'Seen': 1, 'Converted': 0, 'Unchanged': 1, 'Rejected': 0},
+            'urlmdlink': {'Seen': 1, 'Converted': 0, 'Unchanged': 0, 'Rejected': 1},
+            'ahreflink': {'Seen': 1, 'Converted': 0, 'Unchanged': 0, 'Rejected': 1}
+        })
+        self.assertEqual(set(stats['Seconds']), {'classification', 'html', 'splitting', 'encoding'})
+        self.assertEqual(stats['Calls']['html'], 1)
+        self.assertEqual(stats['Calls']['splitting'], 2)
+        self.assertEqual(sum(stats['Calls'].values()), len(calls))
+
+        # Cache hits are counted too
+        link_standarizer.reset_instrumentation()
+        link_standarizer.enable_link_cache()
+        for _ in range(3):
+            link_standarizer.anylink_to_standarizedmdlink("not a link")
+        self.assertEqual(link_standarizer.instrumentation_stats()['Links'],
+                         {'nolink': {'Seen': 3, 'Converted': 0, 'Unchanged': 0, 'Rejected': 3}})
+
+    def test_disable_instrumentation(self):
+        parse_mdlink = link_standarizer._parse_mdlink
+
+        link_standarizer.enable_instrumentation()
+        self.assertIsNot(link_standarizer._parse_mdlink, parse_mdlink)
+
+        # Off again, the original functions are back
+        link_standarizer.disable_instrumentation()
+        self.assertIs(link_standarizer._parse_mdlink, parse_mdlink)
+        self.assertEqual(link_standarizer.anylink_to_standarizedmdlink("[[A]]"), "[[A]](A.md)")
+        self.assertEqual(link_standarizer.instrumentation_stats(), False)
+
+    def test_merge_instrumentation_stats(self):
+        stats = {'Links': {'wikilink': {'Seen': 1, 'Converted': 1}}, 'Seconds': {'html': 0.5}, 'Calls': {'html': 1}}
+        other = {'Links': {'wikilink': {'Seen': 2, 'Converted': 1}, 'nolink': {'Seen': 1}}, 'Seconds': {'html': 0.25},
+                 'Calls': {'html': 2}}
+        self.assertEqual(link_standarizer.merge_instrumentation_stats(stats, other), {
+            'Links': {'wikilink': {'Seen': 3, 'Converted': 2}, 'nolink': {'Seen': 1}},
+            'Seconds': {'html': 0.75},
+            'Calls': {'html': 3}
+        })
+
+
+class TestAhrefLinkToMdlink(unittest.TestCase):
+    def test_multiline_ahreflink_to_mdlink(self):
+        result = link_standarizer.multiline_ahreflink_to_mdlink(
+            "Go to <a href='https://go.to/somefile.html'>title</a>, or <A HREF=\"doc 1.pdf\">PDF <b>doc</b></a>.\n")
+        self.assertEqual(result, "Go to [title](https://go.to/somefile.html), or [PDF doc](doc%201.pdf).\n")
+
+        # Anchors without href, other markup and comments are left as they are
+        text = "<a name='top'>Top</a> <p class='x'>&amp; <!-- <a href='no'>no</a> --></p>\n"
+        self.assertEqual(link_standarizer.multiline_ahreflink_to_mdlink(text), text)
+
+        # Brackets in titles are escaped
+        result = link_standarizer.multiline_ahreflink_to_mdlink("<a href='u'>[1] note</a>")
+        self.assertEqual(result, "[\\[1\\] note](u)")
+
+    def test_stream_ahreflink_to_mdlink(self):
+        lines = ["first <a href='u'>multi\n", "line</a> title\n", "no links\n", "<a href='v'>last</a>"]
+        result = list(link_standarizer.stream_ahreflink_to_mdlink(lines))
+        self.assertEqual(result, ["first [multi line](u) title\n", "no links\n", "[last](v)"])
+
+        # Chained with the link standarizer
+        result = link_standarizer.stream_anylink_standarize(
+            link_standarizer.stream_ahreflink_to_mdlink(["<a href='attachments/document.pdf'>PDF Document</a>\n"]))
+        self.assertEqual(list(result), ["[[document.pdf]](attachments/document.pdf)\n"])
+
+    def test_code_is_left_as_is(self):
+        text = ("Use `<a href=\"x\">y</a>` or <a href='u'>this</a>\n"
+                "\n"
+                "```html\n"
+                "<a href=\"x\">y</a>\n"
+                "```\n"
+                "\n"
+                "    <a href=\"x\">y</a>\n"
+                "\n"
+                "<a href='v'>with `code`</a> <a href='w'>after</a>\n")
+        self.assertEqual(link_standarizer.multiline_ahreflink_to_mdlink(text),
+                         "Use `<a href=\"x\">y</a>` or [this](u)\n"
+                         "\n"
+                         "```html\n"
+                         "<a href=\"x\">y</a>\n"
+                         "```\n"
+                         "\n"
+                         "    <a href=\"x\">y</a>\n"
+                         "\n"
+                         "<a href='v'>with `code`</a> [after](w)\n")
+        self.assertEqual(list(link_standarizer.stream_ahreflink_to_mdlink(text.splitlines(True))),
+                         link_standarizer.multiline_ahreflink_to_mdlink(text).splitlines(True))
+
+        self.assertEqual(link_standarizer.multiline_ahreflink_to_mdlink("`<a href='x'>y</a>`", skip_code=False),
+                         "`[y](x)`")
+
+    def test_stream_ahreflink_to_mdlink_bounded(self):
+        # An anchor that never ends is given up on and copied as it is
+        lines = ["<a href='u'>never closed\n"] + ["text\n"] * 100 + ["<a href='v'>ok</a>\n"]
+        result = list(link_standarizer.stream_ahreflink_to_mdlink(lines, max_anchor_length=100))
+        self.assertEqual(result, lines[:-1] + ["[ok](v)\n"])
+
+        # Malformed markup html.parser rejects
+        lines = ["<![x <a href='u'>a</a>\n", "<a href='v'>b</a>\n"]
+        result = list(link_standarizer.stream_ahreflink_to_mdlink(lines))
+        self.assertEqual(result, ["<![x <a href='u'>a</a>\n", "[b](v)\n"])
+
+    def test_stream_ahreflink_to_mdlink_unclosed_raw_text(self):
+        # Text html.parser holds back until it's closed is given up on too, and lines keep streaming
+        for opener in ("<script>", "`<script>`", "<style>", "<!--", "<![CDATA["):
+            lines = [opener + "\n"] + ["text\n"] * 100 + ["<a href='v'>ok</a>\n"] * 2
+            result = link_standarizer.stream_ahreflink_to_mdlink(iter(lines), max_anchor_length=100)
+            self.assertEqual(next(result), opener + "\n")
+            self.assertEqual(list(result)[-2:], ["[ok](v)\n", "[ok](v)\n"])
+
+
 class TestAhrefLinkSplit(unittest.TestCase):
     def test_ahreflink_split(self):
         # 'ahreflink': HTML formatted link i.e. <a href='url'>title</a>
@@ -306,5 +725,156 @@ class TestAhrefLinkSplit(unittest.TestCase):
             'Class': ''
         })
 
+        # Classes are split like BeautifulSoup does, title is only set for a single string
+        result = link_standarizer.ahreflink_split('Some text <a class="ext  link" href="https://go.to/a&amp;b">Go</a>')
+        self.assertEqual(result, {
+            'Title': 'Go',
+            'Url': 'https://go.to/a&b',
+            'Class': ['ext', 'link']
+        })
+
+        result = link_standarizer.ahreflink_split("<a href='url'>Some <b>bold</b> title</a>")
+        self.assertEqual(result, {
+            'Title': None,
+            'Url': 'url',
+            'Class': ''
+        })
+
+        # Not a link
+        result = link_standarizer.ahreflink_split("<p>No anchors here</p>")
+        self.assertEqual(result, False)
+
+    def test_ahreflink_split_whitespace(self):
+        # Whitespace only titles collapse to a single space, except inside <pre> and <textarea>
+        self.assertEqual(link_standarizer.ahreflink_split("<a href=url>  </a>")['Title'], ' ')
+        self.assertEqual(link_standarizer.ahreflink_split("<pre><a href=url>  </a></pre>")['Title'], '  ')
+        self.assertEqual(link_standarizer.ahreflink_split("<a href=url><textarea>\n\n</textarea></a>")['Title'],
+                         '\n\n')
+
+    def test_ahreflink_split_bs4(self):
+        try:
+            import bs4
+        except ImportError:
+            self.skipTest("bs4 not installed")
+
+        for ahreflink in ("<a href='https://go.to/somefile.html'>title</a>",
+                          '<a class="ext  link" href="https://go.to/a&amp;b">Go</a>',
+                          "<a href='url'>Some <b>bold</b> title</a>",
+                          "<pre><a href=url>  </a></pre>",
+                          "<a href=url><textarea> \n </textarea></a>"):
+            self.assertEqual(link_standarizer.ahreflink_split(ahreflink, use_bs4=True),
+                             link_standarizer.ahreflink_split(ahreflink))
+
+
+class TestFilenameCodec(unittest.TestCase):
+    PIECES = ['a', 'Z', '0', '_', '.', '-', '~', '/', ' ', '%', '#', '?', '+', '\u00e9', '\u20ac', '\U0001f600', '\x00',
+              '\x7f', '%2', '%20', '%2F', '%2f', '%41', '%aF', '%C3%A9', '%c3%a9', '%E2%82%AC', '%F0%9F%98%80',
+              '%ED%A0%80', '%C3', '%A9', '%FF', '%zz', '%E0%80%80', '%F4%8F%BF%BF', '%F4%90%80%80', '%C1%BF', '%7E']
+
+    def test_same_as_urllib(self):
+        rng = random.Random(0)
+
+        for _ in range(5000):
+            name = ''.join(rng.choice(self.PIECES) for _ in range(rng.randrange(12)))
+            requoted = urllib.parse.quote(urllib.parse.unquote(name))
+
+            self.assertEqual(link_standarizer._quote(name), urllib.parse.quote(name))
+            self.assertEqual(link_standarizer._unquote(name), urllib.parse.unquote(name))
+            self.assertEqual(link_standarizer._requote(name), requoted)
+            self.assertEqual(bool(link_standarizer._CANONICAL_QUOTED_REGEX.fullmatch(name)), requoted == name)
+
+    def test_every_byte(self):
+        for byte in range(256):
+            for name in (chr(byte), f'%{byte:02X}', f'%{byte:02x}', f'a%{byte:02X}%80b'):
+                requoted = urllib.parse.quote(urllib.parse.unquote(name))
+                self.assertEqual(link_standarizer._requote(name), requoted)
+                self.assertEqual(bool(link_standarizer._CANONICAL_QUOTED_REGEX.fullmatch(name)), requoted == name)
+
+    def test_surrogates(self):
+        with self.assertRaises(UnicodeEncodeError):
+            link_standarizer._quote('\ud800')
+
+    def test_linear_time(self):
+        start = time.perf_counter()
+        link_standarizer._requote('a' * 100000 + ' b.md')
+        link_standarizer._requote('%C3%A9' * 100000 + '%C3')
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+class TestStdioCommandLine(unittest.TestCase):
+    # Seconds importing link_standarizer, and a whole '-' run, may take with the bytecode cached
+    IMPORT_BUDGET = 0.1
+    STARTUP_BUDGET = 0.5
+
+    NOTE = "a [[Some Note]] and ![[image.png]]\r\n`[[In code]]` <br> caf\u00e9\n".encode('utf-8')
+    STANDARIZED = ("a [[Some Note]](Some%20Note.md) and ![[image.png]](image.png)\r\n`[[In code]]` <br> "
+                   "caf\u00e9\n").encode('utf-8')
+
+    def setUp(self):
+        # The bytecode of link_standarizer in a cache of its own, written by the first run
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = dict(os.environ)
+        self.env.pop('PYTHONDONTWRITEBYTECODE', None)
+        self.env['PYTHONPATH'] = os.path.dirname(os.path.abspath(link_standarizer.__file__))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # Run python -X importtime, returns the output and {module: cumulative seconds}
+    def run_python(self, *args, stdin=b''):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-X', 'pycache_prefix=' + self.tmp.name,
+                                  *args], input=stdin, capture_output=True, env=self.env, check=True)
+
+        imports = {}
+        for line in process.stderr.decode().splitlines():
+            if line.startswith('import time:') and not line.endswith('imported package'):
+                _, cumulative, module = line[len('import time:'):].split('|')
+                imports[module.strip()] = int(cumulative) / 1e6
+
+        return process.stdout, imports
+
+    def test_stdin_to_stdout(self):
+        output, _ = self.run_python('-m', 'link_standarizer', '-', stdin=self.NOTE)
+        self.assertEqual(output, self.STANDARIZED)
+
+        stdout = io.BytesIO()
+        self.assertEqual(link_standarizer.standarize_stdio(io.BytesIO(self.NOTE), stdout), 0)
+        self.assertEqual(stdout.getvalue(), self.STANDARIZED)
+
+    def test_undecodable_stdin(self):
+        stdout = io.BytesIO()
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(link_standarizer.standarize_stdio(io.BytesIO(b'[[caf\xe9]]'), stdout), 1)
+        self.assertEqual(stdout.getvalue(), b'[[caf\xe9]]')
+
+    def test_import_budget(self):
+        self.run_python('-c', 'import link_standarizer')
+
+        seconds = []
+        for _ in range(3):
+            _, imports = self.run_python('-c', 'import link_standarizer')
+            seconds.append(imports['link_standarizer'])
+
+            # Imported only once a note needs them
+            for module in ('urllib.parse', 'html.parser', 'bs4', 'argparse'):
+                self.assertNotIn(module, imports)
+
+        self.assertLess(min(seconds), self.IMPORT_BUDGET)
+
+    def test_startup_budget(self):
+        self.run_python('-m', 'link_standarizer', '-', stdin=self.NOTE)
+
+        seconds = []
+        for _ in range(3):
+            start = time.perf_counter()
+            _, imports = self.run_python('-m', 'link_standarizer', '-', stdin=self.NOTE)
+            seconds.append(time.perf_counter() - start)
+
+            for module in ('urllib.parse', 'html.parser', 'bs4', 'argparse'):
+                self.assertNotIn(module, imports)
+
+        self.assertLess(min(seconds), self.STARTUP_BUDGET)
+
+
 if __name__ == '__main__':
     unittest.main()
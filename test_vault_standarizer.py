@@ -0,0 +1,290 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import link_standarizer
+import vault_standarizer
+
+
+def write_note(vault, relpath, text):
+    path = os.path.join(vault, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+    return path
+
+
+def read_note(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+class TestStandarizeVault(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vault = self.tmp.name
+        self.index = write_note(self.vault, 'Index.md', "See [[Some Note]] and ![](img/a b.png)\r\nplain line\r\n")
+        self.note = write_note(self.vault, 'projects/2020/Some Note.md', "Already [[Index]](Index.md)\n")
+        self.hidden = write_note(self.vault, '.obsidian/cache.md', "[[Hidden]]\n")
+        write_note(self.vault, 'projects/data.txt', "[[Not a note]]\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_iter_markdown_files(self):
+        result = list(vault_standarizer.iter_markdown_files(self.vault))
+        self.assertEqual(result, [self.index, self.note])
+
+    def test_standarize_vault_in_process(self):
+        summary = vault_standarizer.standarize_vault(self.vault, workers=1)
+        self.assertEqual(summary, vault_standarizer.VaultSummary(files=2, files_changed=1, links_changed=2))
+
+        # Line endings are kept
+        self.assertEqual(read_note(self.index), "See [[Some Note]](Some%20Note.md) and "
+                                                "![[a b.png]](img/a%20b.png)\r\nplain line\r\n")
+        self.assertEqual(read_note(self.note), "Already [[Index]](Index.md)\n")
+        self.assertEqual(read_note(self.hidden), "[[Hidden]]\n")
+
+    def test_standarize_vault_pool(self):
+        for ordered in (True, False):
+            summary = vault_standarizer.standarize_vault(self.vault, workers=2, chunksize=1, ordered=ordered)
+            self.assertEqual(summary.files, 2)
+
+        # Second run had nothing left to change
+        self.assertEqual(summary.links_changed, 0)
+        self.assertEqual(read_note(self.note), "Already [[Index]](Index.md)\n")
+
+    def test_incremental(self):
+        summary = vault_standarizer.standarize_vault(self.vault, workers=1, incremental=True)
+        self.assertEqual(summary, vault_standarizer.VaultSummary(files=2, files_changed=1, links_changed=2,
+                                                                 files_skipped=0))
+        manifest_path = os.path.join(self.vault, vault_standarizer.MANIFEST_FILENAME)
+        self.assertEqual(set(vault_standarizer.load_manifest(manifest_path)), {'Index.md', 'projects/2020/Some Note.md'})
+
+        # Nothing changed: every file is skipped
+        summary = vault_standarizer.standarize_vault(self.vault, workers=1, incremental=True)
+        self.assertEqual(summary, vault_standarizer.VaultSummary(files=2, files_changed=0, links_changed=0,
+                                                                 files_skipped=2))
+
+        # Touched but same content: read, not parsed
+        os.utime(self.note, ns=(0, 0))
+        # Edited
+        write_note(self.vault, 'projects/2020/New.md', "[[New link]]\n")
+        summary = vault_standarizer.standarize_vault(self.vault, workers=2, incremental=True)
+        self.assertEqual(summary, vault_standarizer.VaultSummary(files=3, files_changed=1, links_changed=1,
+                                                                 files_skipped=2))
+
+    def test_manifest_invalidated_by_rules(self):
+        manifest_path = os.path.join(self.vault, vault_standarizer.MANIFEST_FILENAME)
+        vault_standarizer.save_manifest(manifest_path, {'Index.md': [1, 2, 'abc']})
+        self.assertEqual(vault_standarizer.load_manifest(manifest_path), {'Index.md': [1, 2, 'abc']})
+
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest['rules'] = 'older rules'
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        self.assertEqual(vault_standarizer.load_manifest(manifest_path), {})
+
+    def test_standarize_vault_cache(self):
+        for workers in (1, 2):
+            summary = vault_standarizer.standarize_vault(self.vault, workers=workers, cache_size=16)
+            self.assertEqual(summary.files, 2)
+
+        self.assertEqual(link_standarizer.link_cache_stats(), False)
+        self.assertIn("[[Some Note]](Some%20Note.md)", read_note(self.index))
+
+    def test_standarize_vault_instrumentation(self):
+        for workers in (1, 2):
+            summary = vault_standarizer.standarize_vault(self.vault, workers=workers, instrument=True)
+            links = summary.instrumentation['Links']
+            self.assertEqual(sum(counts['Seen'] for counts in links.values()), 3)
+
+        self.assertEqual(link_standarizer.instrumentation_stats(), False)
+
+    def test_main_stats(self):
+        stats_path = os.path.join(self.vault, 'stats.json')
+        self.assertEqual(link_standarizer.main([self.vault, '-j', '1', '--stats', stats_path]), 0)
+
+        with open(stats_path, encoding='utf-8') as f:
+            stats = json.load(f)
+        self.assertEqual(stats['Summary']['links_changed'], 2)
+        self.assertEqual(stats['Links']['wikilink']['Converted'], 1)
+
+    def test_standarize_vault_resolve_wikilinks(self):
+        write_note(self.vault, 'img/a b.png', '')
+
+        for workers in (1, 2):
+            write_note(self.vault, 'Index.md', "See [[Some Note]] and ![[a b.png]]\n")
+            vault_standarizer.standarize_vault(self.vault, workers=workers, resolve_wikilinks=True)
+            self.assertEqual(read_note(self.index), "See [[Some Note]](projects/2020/Some%20Note.md) and "
+                                                    "![[a b.png]](img/a%20b.png)\n")
+
+    def test_only_changed_files_are_written(self):
+        os.chmod(self.index, 0o640)
+        os.utime(self.note, ns=(0, 0))
+
+        vault_standarizer.standarize_vault(self.vault, workers=1)
+        self.assertEqual(os.stat(self.note).st_mtime_ns, 0)
+        self.assertEqual(os.stat(self.index).st_mode & 0o777, 0o640)
+        self.assertIn("[[Some Note]](Some%20Note.md)", read_note(self.index))
+
+        # No temporary files left behind
+        self.assertEqual(sorted(os.listdir(self.vault)), ['.obsidian', 'Index.md', 'projects'])
+
+    def test_symlinked_note(self):
+        target = write_note(self.vault, 'real/Linked.md', "[[Some Note]]\n")
+        link = os.path.join(self.vault, 'Link.md')
+        os.symlink(target, link)
+
+        vault_standarizer.standarize_file(link)
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(read_note(target), "[[Some Note]](Some%20Note.md)\n")
+
+    def test_dry_run(self):
+        before = read_note(self.index)
+
+        for workers in (1, 2):
+            summary = vault_standarizer.standarize_vault(self.vault, workers=workers, dry_run=True, incremental=True)
+            self.assertEqual(summary, vault_standarizer.VaultSummary(files=2, files_changed=1, links_changed=2))
+            self.assertEqual(read_note(self.index), before)
+
+        self.assertFalse(os.path.exists(os.path.join(self.vault, vault_standarizer.MANIFEST_FILENAME)))
+
+    def test_diff(self):
+        result = vault_standarizer.standarize_file(self.index, diff=True)
+        self.assertEqual(result.links_changed, 2)
+        self.assertEqual(result.diff.splitlines()[2:4],
+                         ["@@ -1,2 +1,2 @@", "-See [[Some Note]] and ![](img/a b.png)"])
+        self.assertIn("\n+See [[Some Note]](Some%20Note.md) and ![[a b.png]](img/a%20b.png)\r\n", result.diff)
+        self.assertEqual(read_note(self.index), "See [[Some Note]] and ![](img/a b.png)\r\nplain line\r\n")
+
+    def test_undecodable_file(self):
+        bad = os.path.join(self.vault, 'Bad.md')
+        with open(bad, 'wb') as f:
+            f.write("[[Caf\u00e9]]\n".encode('latin-1'))
+
+        for workers in (1, 2):
+            with contextlib.redirect_stderr(io.StringIO()) as errors:
+                summary = vault_standarizer.standarize_vault(self.vault, workers=workers, incremental=True)
+            self.assertEqual(summary.files_failed, 1)
+            self.assertIn('Bad.md', errors.getvalue())
+
+        # The rest of the vault is still standarized, and the bad file is left out of the manifest
+        self.assertIn("[[Some Note]](Some%20Note.md)", read_note(self.index))
+        manifest = vault_standarizer.load_manifest(os.path.join(self.vault, vault_standarizer.MANIFEST_FILENAME))
+        self.assertNotIn('Bad.md', manifest)
+
+        with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(link_standarizer.main([self.vault, '-j', '1']), 1)
+
+    def test_resolve_wikilinks_relative_vault(self):
+        write_note(self.vault, 'notes/a.md', "[[Some Note]]\n")
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(self.vault))
+        try:
+            vault_standarizer.standarize_vault(os.path.basename(self.vault), workers=1, resolve_wikilinks=True)
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(read_note(os.path.join(self.vault, 'notes/a.md')),
+                         "[[Some Note]](../projects/2020/Some%20Note.md)\n")
+
+    def test_main(self):
+        self.assertEqual(link_standarizer.main([self.vault, '-j', '1']), 0)
+        self.assertEqual(read_note(self.hidden), "[[Hidden]]\n")
+        self.assertIn("[[Some Note]](Some%20Note.md)", read_note(self.index))
+
+
+class TestStandarizeLargeFile(unittest.TestCase):
+    # Blocks to split at, fenced blocks with blank lines inside included
+    BLOCKS = ["# Export\r\n\r\nSee [[Some Note]] and ![[image.png]]\r\n",
+              "```\n[[In fence]]\n\nstill [[in fence]]\n```\n",
+              "- item [a](b c.md)\n\n    [[list content]]\n",
+              "~~~\n\n\nno [[links]] here\n~~~\n",
+              "    [[indented code]]\n\n`[[inline]]` [[caf\u00e9]]\n",
+              "plain prose without links\n\n"]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.text = '\n'.join(self.BLOCKS[i % len(self.BLOCKS)] for i in range(60))
+        self.path = write_note(self.tmp.name, 'export.md', self.text)
+        self.output = os.path.join(self.tmp.name, 'output.md')
+        self.links_changed = link_standarizer._standarize_text(self.text)[1]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_as_sequential(self):
+        expected = link_standarizer.multiline_anylink_standarize(self.text)
+        self.assertNotEqual(expected, self.text)
+
+        for workers in (1, 2):
+            for chunk_size in (1, 7, 64, 1 << 20):
+                result = vault_standarizer.standarize_large_file(self.path, self.output, workers=workers,
+                                                                 chunk_size=chunk_size)
+                self.assertEqual(read_note(self.output), expected)
+                self.assertEqual(result.links_changed, self.links_changed)
+
+        # Without code skipping too
+        vault_standarizer.standarize_large_file(self.path, self.output, workers=2, chunk_size=16, skip_code=False)
+        self.assertEqual(read_note(self.output), link_standarizer.multiline_anylink_standarize(self.text,
+                                                                                               skip_code=False))
+
+    def test_chunk_bounds(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        bounds = list(vault_standarizer._chunk_bounds(data, 64))
+        self.assertGreater(len(bounds), 10)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], len(data))
+
+        for (_, end), (start, _) in zip(bounds, bounds[1:]):
+            self.assertEqual(end, start)
+            # After a blank line, before a line that doesn't start code
+            self.assertEqual(data[:end].rstrip(b' \t\r')[-2:], b'\n\n')
+            self.assertNotIn(data[end:end + 1], b' \t`~\r\n')
+
+    def test_in_place(self):
+        result = vault_standarizer.standarize_large_file(self.path, workers=1, chunk_size=64)
+        self.assertEqual(read_note(self.path), link_standarizer.multiline_anylink_standarize(self.text))
+        self.assertEqual(result.links_changed, self.links_changed)
+
+        # Nothing left to change, the file isn't written again
+        inode = os.stat(self.path).st_ino
+        self.assertEqual(vault_standarizer.standarize_large_file(self.path, workers=1, chunk_size=64).links_changed,
+                         0)
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+
+    def test_dry_run(self):
+        result = vault_standarizer.standarize_large_file(self.path, workers=1, chunk_size=64, dry_run=True)
+        self.assertEqual(result.links_changed, self.links_changed)
+        self.assertEqual(read_note(self.path), self.text)
+
+    def test_empty_file(self):
+        path = write_note(self.tmp.name, 'empty.md', '')
+        self.assertEqual(vault_standarizer.standarize_large_file(path, self.output, workers=1).links_changed, 0)
+        self.assertEqual(read_note(self.output), '')
+
+    def test_main(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(link_standarizer.main([self.path, '-j', '1', '--chunk-mb', '1']), 0)
+        self.assertEqual(read_note(self.path), link_standarizer.multiline_anylink_standarize(self.text))
+
+    def test_main_vault_options(self):
+        # Rejected rather than ignored, nothing is written
+        for options in (['--diff'], ['--check'], ['--resolve-wikilinks', '--stats', 'stats.json']):
+            with contextlib.redirect_stderr(io.StringIO()) as stderr, self.assertRaises(SystemExit) as cm:
+                link_standarizer.main([self.path, '-j', '1'] + options)
+            self.assertEqual(cm.exception.code, 2)
+            self.assertIn(options[0], stderr.getvalue())
+            self.assertEqual(read_note(self.path), self.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
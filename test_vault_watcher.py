@@ -0,0 +1,101 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import vault_watcher
+from test_vault_standarizer import read_note, write_note
+
+
+class TestVaultWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vault = self.tmp.name
+        # There before the watch, left as it is
+        self.existing = write_note(self.vault, 'Existing.md', "[[Index]]\n")
+        self.results = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # Run a watcher while scenario runs, then until it's idle
+    def watch(self, scenario, **options):
+        async def main():
+            watcher = vault_watcher.VaultWatcher(self.vault, interval=0.01, debounce=0.1,
+                                                 on_result=self.results.append, **options)
+            task = asyncio.ensure_future(watcher.run())
+            await asyncio.sleep(0.05)
+
+            await scenario()
+
+            # Idle for a while, so its own writes would show up as changes
+            deadline = time.monotonic() + 10
+            idle_since = time.monotonic()
+            while time.monotonic() < deadline and time.monotonic() - idle_since < 0.3:
+                await asyncio.sleep(0.01)
+                if watcher.busy():
+                    idle_since = time.monotonic()
+
+            watcher.stop()
+            await task
+
+        asyncio.run(main())
+
+    def save(self, relpath, text):
+        path = write_note(self.vault, relpath, text)
+        # Saves in the same tick can share an mtime, like on coarse file systems
+        os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        return path
+
+    def test_burst_of_saves(self):
+        async def scenario():
+            for i in range(5):
+                self.save('Note.md', f"Draft {i} of [[Some Note]]\n")
+                await asyncio.sleep(0.02)
+
+        self.watch(scenario)
+
+        # Standarized once, and its own write didn't bring it back
+        path = os.path.join(self.vault, 'Note.md')
+        self.assertEqual(self.results, [self.results[0]])
+        self.assertEqual(self.results[0].path, path)
+        self.assertEqual(read_note(path), "Draft 4 of [[Some Note]](Some%20Note.md)\n")
+        self.assertEqual(read_note(self.existing), "[[Index]]\n")
+
+    def test_saved_again(self):
+        async def scenario():
+            self.save('Note.md', "[[A]]\n")
+            while not self.results:
+                await asyncio.sleep(0.01)
+            self.save('Note.md', "[[A]](A.md) and [[B]]\n")
+
+        self.watch(scenario)
+
+        self.assertEqual([result.links_changed for result in self.results], [1, 1])
+        self.assertEqual(read_note(os.path.join(self.vault, 'Note.md')), "[[A]](A.md) and [[B]](B.md)\n")
+
+    def test_many_notes_on_processes(self):
+        async def scenario():
+            for i in range(6):
+                self.save(f'folder/Note {i}.md', f"[[Note {i + 1}]]\n")
+
+        self.watch(scenario, workers=2)
+
+        self.assertEqual(sorted(os.path.basename(result.path) for result in self.results),
+                         [f'Note {i}.md' for i in range(6)])
+        self.assertEqual(read_note(os.path.join(self.vault, 'folder/Note 0.md')), "[[Note 1]](Note%201.md)\n")
+
+    def test_undecodable_note(self):
+        async def scenario():
+            with open(os.path.join(self.vault, 'Bad.md'), 'wb') as f:
+                f.write("[[Café]]\n".encode('latin-1'))
+
+        self.watch(scenario)
+
+        self.assertEqual(len(self.results), 1)
+        self.assertIsNotNone(self.results[0].error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,530 @@
+import os
+
+import collections
+import contextlib
+import difflib
+import functools
+import hashlib
+import json
+import mmap
+import multiprocessing
+import re
+import stat
+import sys
+import tempfile
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import link_standarizer
+
+# Incremental runs keep their manifest here, inside the vault. Hidden, so it's never walked as a note
+MANIFEST_FILENAME = '.link_standarizer_manifest.json'
+
+# Bump when the manifest layout changes
+_MANIFEST_FORMAT = 1
+
+# Bytes of a large file standarized at a time, see standarize_large_file()
+LARGE_FILE_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Where a large file can be split: right after a blank line, before an unindented line that doesn't open a fenced
+# block. Lexing the line after it doesn't depend on anything before, unless the blank line is in a fenced block
+_CHUNK_BOUNDARY_REGEX = re.compile(rb'\n[ \t]*\r?\n(?=[!-_a-}])')
+
+
+# Result of standarizing one file. Size, mtime and digest describe the file as it was left, for the manifest
+class FileResult(NamedTuple):
+    path: str
+    links_changed: int
+    size: Optional[int] = None
+    mtime_ns: Optional[int] = None
+    digest: Optional[str] = None
+    skipped: bool = False
+    instrumentation: Optional[dict] = None
+    diff: Optional[str] = None
+    # Why the file couldn't be standarized, i.e. it's not UTF-8. Failed files are left as they were
+    error: Optional[str] = None
+
+
+# Totals of a vault run
+class VaultSummary(NamedTuple):
+    files: int
+    files_changed: int
+    links_changed: int
+    files_skipped: int = 0
+    instrumentation: Optional[dict] = None
+    files_failed: int = 0
+
+
+# Walk a vault and yield every markdown file, in a stable order. Hidden folders (.obsidian, .git, .trash) are skipped
+def iter_markdown_files(vault: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(vault):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.md'):
+                yield os.path.join(dirpath, filename)
+
+
+# Standarize the links of a single file, rewriting it only if a link changed
+def standarize_file(path: str, known_digest: Optional[str] = None, resolver=None, dry_run: bool = False,
+                    diff: bool = False) -> FileResult:
+    """
+    Standarize the links of a file in place. The new content is written to a temporary file next to it and renamed
+    over it, so the file is never left half written, and it keeps its permissions.
+
+    :string path: Markdown file
+    :string known_digest: Content digest from the last run. If the file still has it, it's not parsed again
+    :callable resolver: Optional wikilink resolver, see link_standarizer.wikilink_to_mdlink()
+    :bool dry_run: Don't write the file, only count the links that would change
+    :bool diff: Don't write the file, return a unified diff of the changes with the result
+
+    :return: returns the links changed and the size, mtime and digest of the file as it was left
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    digest = content_digest(data)
+    if digest == known_digest:
+        st = os.stat(path)
+        return FileResult(path, 0, st.st_size, st.st_mtime_ns, digest, skipped=True)
+
+    # No '[' byte, no links: not even decoded. '[' never shows up inside a multibyte UTF-8 character
+    links_changed = 0
+    if b'[' in data:
+        original = data.decode('utf-8')
+        text, links_changed = link_standarizer._standarize_text(original, resolver)
+
+    changes = None
+    if links_changed and diff:
+        changes = unified_diff(path, original, text)
+    elif links_changed and not dry_run:
+        data = text.encode('utf-8')
+        digest = content_digest(data)
+        write_atomic(path, data)
+
+    st = os.stat(path)
+
+    return FileResult(path, links_changed, st.st_size, st.st_mtime_ns, digest, diff=changes)
+
+
+# Replace the content of a file with a temporary file renamed over it, keeping its permissions. Readers see either
+# the old or the new content, never a mix, and an interrupted write leaves the file as it was
+def write_atomic(path: str, data: bytes):
+    with _atomic_file(path) as f:
+        f.write(data)
+
+
+# Binary file to write the new content of path to, renamed over it once the block ends. Its permissions are kept,
+# or taken from mode_path if path doesn't exist yet
+@contextlib.contextmanager
+def _atomic_file(path: str, mode_path: Optional[str] = None):
+    # A symlinked note is written through the link, renaming over the link would replace it
+    path = os.path.realpath(path)
+    mode = stat.S_IMODE(os.stat(path if mode_path is None or os.path.exists(path) else mode_path).st_mode)
+
+    # Same folder, so the rename never crosses file systems. Hidden and not .md, walks never pick it up
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            # On disk before the rename, or a crash could leave the note renamed but empty
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# Standarize a single huge file, split in chunks standarized in parallel
+def standarize_large_file(path: str, output_path: Optional[str] = None, workers: Optional[int] = None,
+                          chunk_size: int = LARGE_FILE_CHUNK_SIZE, skip_code: bool = True,
+                          dry_run: bool = False) -> FileResult:
+    """
+    Standarize the links of a file too big to handle whole, i.e. a multi-GB export, with a pool of worker processes.
+    The file is memory-mapped and split in chunks of about chunk_size bytes, always after a blank line, and workers
+    read their chunk from the map. The output is the same, byte for byte, as
+    link_standarizer.multiline_anylink_standarize() of the whole file.
+
+    Chunks are handed out a few at a time, so no more than two per worker are in memory, and written in order as they
+    come back. Only the chunks whose links changed are sent back, the rest are copied from the map. The output is
+    written to a temporary file renamed over output_path. In place, it's not written at all if no link changed.
+
+    A chunk is standarized as if no fenced block was open when it starts. In the rare case one was, i.e. a blank line
+    inside a fenced block, it's standarized again, in this process, once the chunk before it is done.
+
+    :string path: File to standarize
+    :string output_path: Where to write the standarized file, path itself by default
+    :int workers: Worker processes, one per CPU by default. 1 runs everything in this process
+    :int chunk_size: Bytes per chunk. Text without blank lines can't be split, so chunks can be longer
+    :bool skip_code: Leave fenced blocks, indented blocks and inline code as they are
+    :bool dry_run: Don't write anything, only count the links that would change
+
+    :return: returns the links changed, and the size and mtime of the output unless it's a dry run
+    """
+    if output_path is None:
+        output_path = path
+
+    links_changed = 0
+    output = None
+
+    with open(path, 'rb') as f, contextlib.ExitStack() as stack:
+        # mmap can't map empty files
+        size = os.fstat(f.fileno()).st_size
+        mm = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if size else b''
+
+        written = 0
+        for start, end, changed, data in _standarize_chunks(path, mm, workers, chunk_size, skip_code):
+            if not changed:
+                continue
+
+            links_changed += changed
+            if dry_run:
+                continue
+
+            if output is None:
+                output = stack.enter_context(_atomic_file(output_path, path))
+
+            # Unchanged text up to the chunk, straight from the map
+            _copy_range(mm, written, start, output, chunk_size)
+            output.write(data)
+            written = end
+
+        if output is not None:
+            _copy_range(mm, written, size, output, chunk_size)
+        elif not dry_run and output_path != path:
+            # Nothing changed, a copy of the file
+            with _atomic_file(output_path, path) as copy:
+                _copy_range(mm, 0, size, copy, chunk_size)
+
+    if dry_run:
+        return FileResult(path, links_changed)
+
+    st = os.stat(output_path)
+
+    return FileResult(path, links_changed, st.st_size, st.st_mtime_ns)
+
+
+# Write mm[start:end] to a file, a chunk at a time
+def _copy_range(mm, start: int, end: int, output, chunk_size: int):
+    for pos in range(start, end, chunk_size):
+        output.write(mm[pos:min(pos + chunk_size, end)])
+
+
+# Chunks of a mapped file split at boundaries where lexing can start over, as (start, end)
+def _chunk_bounds(mm, chunk_size: int) -> Iterator[Tuple[int, int]]:
+    start = 0
+
+    while start < len(mm):
+        m = _CHUNK_BOUNDARY_REGEX.search(mm, start + chunk_size) if start + chunk_size < len(mm) else None
+        end = m.end() if m else len(mm)
+
+        yield start, end
+        start = end
+
+
+# Standarize the chunks of a mapped file, yielding (start, end, links changed, standarized chunk) in file order.
+# Unchanged chunks come back without their text
+def _standarize_chunks(path: str, mm, workers: Optional[int], chunk_size: int,
+                       skip_code: bool) -> Iterator[Tuple[int, int, int, Optional[bytes]]]:
+    bounds = _chunk_bounds(mm, chunk_size)
+    fence_state = None
+
+    if workers == 1:
+        for start, end in bounds:
+            changed, data, fence_state = _standarize_chunk_job((path, start, end, skip_code, fence_state))
+            yield start, end, changed, data
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        # Chunks being standarized, in order. Twice the workers, so none waits while the results are written
+        pending = collections.deque()
+        window = 2 * (workers or os.cpu_count() or 1)
+
+        def collect() -> Tuple[int, int, int, Optional[bytes]]:
+            nonlocal fence_state
+
+            (start, end), result = pending.popleft()
+            changed, data, end_state = result.get()
+
+            # Standarized as if out of fenced blocks, but a fenced block was open: again, from where it was
+            if fence_state is not None:
+                changed, data, end_state = _standarize_chunk_job((path, start, end, skip_code, fence_state))
+
+            fence_state = end_state
+            return start, end, changed, data
+
+        for bound in bounds:
+            pending.append((bound, pool.apply_async(_standarize_chunk_job, ((path, *bound, skip_code, None),))))
+
+            while pending and (len(pending) >= window or pending[0][1].ready()):
+                yield collect()
+
+        while pending:
+            yield collect()
+
+
+# Pool entry point for a chunk of a large file: (path, start, end, skip_code, fence state). Returns the links
+# changed, the standarized chunk if they did and the fence state it ends in
+def _standarize_chunk_job(job: tuple) -> Tuple[int, Optional[bytes], Optional[tuple]]:
+    path, start, end, skip_code, fence_state = job
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+
+    text, links_changed, fence_state = link_standarizer._standarize_chunk(data.decode('utf-8'), None, skip_code,
+                                                                          fence_state)
+
+    return links_changed, text.encode('utf-8') if links_changed else None, fence_state
+
+
+# Unified diff of the text of a file before and after standarizing it
+def unified_diff(path: str, before: str, after: str) -> str:
+    lines = []
+
+    for ln in difflib.unified_diff(before.splitlines(True), after.splitlines(True), path, path):
+        lines.append(ln)
+        if not ln.endswith('\n'):
+            lines.append('\n\\ No newline at end of file\n')
+
+    return ''.join(lines)
+
+
+# Digest of a file content, as stored in the manifest
+def content_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# Version of the standarization rules. Any change to link_standarizer.py invalidates the manifests
+def rules_version() -> str:
+    with open(link_standarizer.__file__, 'rb') as f:
+        return content_digest(f.read())
+
+
+# Load the manifest of the last run. Returns {} if there is none, or it was written with other rules
+def load_manifest(path: str) -> dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get('format') != _MANIFEST_FORMAT or manifest.get('rules') != rules_version():
+        return {}
+
+    return manifest.get('files', {})
+
+
+# Save the manifest: {relative path: [size, mtime_ns, digest]}
+def save_manifest(path: str, files: dict):
+    manifest = {
+        'format': _MANIFEST_FORMAT,
+        'rules': rules_version(),
+        'files': files
+    }
+
+    # Write and rename, so an interrupted run never leaves half a manifest
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+# Standarize every markdown file in a vault, in parallel
+def standarize_vault(vault: str, workers: Optional[int] = None, chunksize: int = 8, ordered: bool = True,
+                     verbose: bool = False, incremental: bool = False, manifest_path: Optional[str] = None,
+                     cache_size: Optional[int] = None, instrument: bool = False,
+                     resolve_wikilinks: bool = False, dry_run: bool = False, diff: bool = False) -> VaultSummary:
+    """
+    Standarize the links of every .md file under vault with a pool of worker processes.
+
+    :string vault: Directory with the markdown notes
+    :int workers: Worker processes, one per CPU by default. 1 runs everything in this process
+    :int chunksize: Files sent to a worker at a time. Bigger chunks mean less overhead, smaller better balancing
+    :bool ordered: Collect results in walk order. Unordered collects them as soon as each worker is done
+    :bool verbose: Print every changed file to stdout
+    :bool incremental: Skip files that didn't change since the last incremental run, using a manifest of their
+                       size, mtime and content digest
+    :string manifest_path: Where to keep the manifest, MANIFEST_FILENAME inside the vault by default
+    :int cache_size: Cache this many link conversions in every worker, see link_standarizer.enable_link_cache()
+    :bool instrument: Count links and time every phase in the workers, see link_standarizer.enable_instrumentation().
+                      The stats of all the workers are added up in the summary
+    :bool resolve_wikilinks: Link wikilinks to the path of the file they point to, from an index of the vault file
+                             names built once and shared with the workers. See link_index.FilenameIndex
+    :bool dry_run: Don't write any file, only count the links that would change. The manifest is not saved either
+    :bool diff: Like dry_run, and print a unified diff of every file that would change
+
+    :return: returns the files seen, changed and skipped, and the links changed
+    """
+    filename_index = None
+    if resolve_wikilinks:
+        import link_index
+        filename_index = link_index.FilenameIndex(vault)
+
+    worker_setup = (cache_size, instrument, filename_index)
+    job = functools.partial(_standarize_job, dry_run=dry_run, diff=diff)
+
+    if not incremental:
+        return _run(_map(job, ((path, None) for path in iter_markdown_files(vault)), workers, chunksize, ordered,
+                         worker_setup), verbose)
+
+    if manifest_path is None:
+        manifest_path = os.path.join(vault, MANIFEST_FILENAME)
+
+    jobs, files = _incremental_jobs(vault, load_manifest(manifest_path))
+    unchanged = len(files)
+
+    def record(results: Iterable[FileResult]) -> Iterator[FileResult]:
+        for result in results:
+            # Failed files are tried again next run
+            if result.error is None:
+                files[os.path.relpath(result.path, vault)] = [result.size, result.mtime_ns, result.digest]
+            yield result
+
+    summary = _run(record(_map(job, jobs, workers, chunksize, ordered, worker_setup)), verbose)
+
+    # Files left unstandarized must not be taken as done by the next run
+    if not (dry_run or diff):
+        save_manifest(manifest_path, files)
+
+    return summary._replace(files=summary.files + unchanged, files_skipped=summary.files_skipped + unchanged)
+
+
+# Split the vault in files to standarize and manifest entries of files left as they were in the last run. A file
+# whose size and mtime match is never opened, one whose content digest matches is read but not parsed
+def _incremental_jobs(vault: str, manifest: dict) -> Tuple[List[Tuple[str, Optional[str]]], dict]:
+    jobs = []
+    unchanged = {}
+
+    for path in iter_markdown_files(vault):
+        # Files are stored relative to the vault, so the manifest survives moving it
+        relpath = os.path.relpath(path, vault)
+        entry = manifest.get(relpath)
+
+        if entry is None:
+            jobs.append((path, None))
+            continue
+
+        size, mtime_ns, digest = entry
+        st = os.stat(path)
+
+        if st.st_size == size and st.st_mtime_ns == mtime_ns:
+            unchanged[relpath] = entry
+        elif st.st_size == size:
+            jobs.append((path, digest))
+        else:
+            jobs.append((path, None))
+
+    return jobs, unchanged
+
+
+# Pool entry point, jobs are (path, known digest). With instrumentation on, the stats of the file go back with it.
+# Files that can't be read or decoded come back with the error
+def _standarize_job(job: Tuple[str, Optional[str]], dry_run: bool = False, diff: bool = False) -> FileResult:
+    path, known_digest = job
+    resolver = None
+    if _filename_index is not None:
+        # Vault relative, the resolver takes relative paths as relative to the vault, not the working directory
+        resolver = _filename_index.resolver(os.path.relpath(path, _filename_index.vault).replace(os.sep, '/'))
+
+    # One bad file doesn't stop the run
+    try:
+        result = standarize_file(path, known_digest, resolver, dry_run, diff)
+    except (OSError, UnicodeDecodeError) as e:
+        result = FileResult(path, 0, error=str(e))
+
+    stats = link_standarizer.instrumentation_stats()
+    if stats:
+        link_standarizer.reset_instrumentation()
+        result = result._replace(instrumentation=stats)
+
+    return result
+
+
+# Run jobs in this process (workers=1) or in a pool of worker processes. worker_setup is what _init_worker() takes.
+# With a cache size, the run gets its own link cache, else it uses whatever cache the process has. Same for
+# instrumentation
+def _map(function, jobs: Iterable, workers: Optional[int], chunksize: int, ordered: bool,
+         worker_setup: tuple = (None, False, None)) -> Iterator:
+    if workers == 1:
+        previous = (link_standarizer._link_cache, link_standarizer._instrumentation is not None, _filename_index)
+        _init_worker(*worker_setup)
+        try:
+            yield from map(function, jobs)
+        finally:
+            _restore_worker(*previous)
+        return
+
+    with multiprocessing.Pool(workers, _init_worker, worker_setup) as pool:
+        if ordered:
+            yield from pool.imap(function, jobs, chunksize)
+        else:
+            yield from pool.imap_unordered(function, jobs, chunksize)
+
+
+# File name index of the vault in a worker, to resolve wikilinks
+_filename_index = None
+
+
+# Set up the link cache, instrumentation and file name index of a worker process
+def _init_worker(cache_size: Optional[int] = None, instrument: bool = False, filename_index=None):
+    global _filename_index
+
+    if cache_size:
+        link_standarizer.enable_link_cache(cache_size)
+
+    if instrument and link_standarizer._instrumentation is None:
+        link_standarizer.enable_instrumentation()
+
+    _filename_index = filename_index
+
+
+# Put back what _init_worker() changed, after a run in this process
+def _restore_worker(link_cache, instrumentation: bool, filename_index):
+    global _filename_index
+
+    link_standarizer._link_cache = link_cache
+    if not instrumentation:
+        link_standarizer.disable_instrumentation()
+
+    _filename_index = filename_index
+
+
+# Add up file results as they arrive
+def _run(results: Iterable[FileResult], verbose: bool) -> VaultSummary:
+    files = files_changed = links_changed = files_skipped = files_failed = 0
+    instrumentation = None
+
+    for result in results:
+        files += 1
+
+        if result.error is not None:
+            files_failed += 1
+            print(f"{result.path}: {result.error}", file=sys.stderr)
+
+        if result.instrumentation is not None:
+            instrumentation = link_standarizer.merge_instrumentation_stats(instrumentation or {},
+                                                                           result.instrumentation)
+
+        if result.skipped:
+            files_skipped += 1
+
+        if result.links_changed:
+            files_changed += 1
+            links_changed += result.links_changed
+
+            if verbose:
+                print(f"{result.path}: {result.links_changed} links changed")
+
+        if result.diff:
+            print(result.diff, end='')
+
+    return VaultSummary(files, files_changed, links_changed, files_skipped, instrumentation, files_failed)
+
+
+# One line summary for the command line
+def format_summary(summary: VaultSummary) -> str:
+    return (f"{summary.files} files, {summary.files_changed} changed, "
+            f"{summary.links_changed} links changed, {summary.files_skipped} skipped" +
+            (f", {summary.files_failed} failed" if summary.files_failed else ""))
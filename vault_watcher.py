@@ -0,0 +1,173 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+import vault_standarizer
+from vault_standarizer import FileResult
+
+
+class VaultWatcher:
+    """
+    Standarizes the notes of a vault seconds after they are saved. The vault is polled for notes whose size or mtime
+    changed; a note is standarized once it has been left alone for debounce seconds, so a burst of saves is
+    standarized once. Notes are standarized on a bounded pool of workers, one job per note at a time: a note saved
+    again while it's being standarized is queued once more, after it's done.
+
+    Its own writes don't count as changes: a note is stat'ed again once it's standarized, and only changes that
+    aren't its own write are queued. Notes already in the vault when the watch starts are left as they are.
+    """
+
+    def __init__(self, vault: str, interval: float = 1.0, debounce: float = 2.0, workers: Optional[int] = 1,
+                 resolve_wikilinks: bool = False, on_result: Optional[Callable[[FileResult], None]] = None):
+        """
+        :string vault: Directory with the markdown notes
+        :float interval: Seconds between polls of the vault
+        :float debounce: Seconds a note must go unchanged before it's standarized
+        :int workers: Worker processes, None for one per CPU. 1 standarizes in a thread of this process
+        :bool resolve_wikilinks: Link wikilinks to the path of the file they point to, see link_index.FilenameIndex.
+                                 The file index is built once, when the watch starts
+        :callable on_result: Called with the FileResult of every note standarized, in the event loop
+        """
+        self.vault = os.path.abspath(vault)
+        self.interval = interval
+        self.debounce = debounce
+        self.workers = workers
+        self.resolve_wikilinks = resolve_wikilinks
+        self.on_result = on_result
+        # Path -> (size, mtime_ns) as last seen
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        # Path -> loop time of its last change, waiting for the debounce
+        self._pending: Dict[str, float] = {}
+        # Path -> job standarizing it
+        self._running: Dict[str, asyncio.Future] = {}
+        self._stop: Optional[asyncio.Event] = None
+
+    # Watch until stop() is called or the task is cancelled
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._snapshot = await loop.run_in_executor(None, self._scan)
+        self._pending = {}
+        self._running = {}
+
+        filename_index = None
+        if self.resolve_wikilinks:
+            import link_index
+            filename_index = await loop.run_in_executor(None, link_index.FilenameIndex, self.vault)
+
+        executor, restore = self._executor(filename_index)
+        try:
+            while not self._stop.is_set():
+                self._queue_changes(await loop.run_in_executor(None, self._scan), loop.time())
+                self._start_jobs(executor, loop.time())
+
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            if self._running:
+                await asyncio.gather(*self._running.values())
+        finally:
+            executor.shutdown(wait=True)
+            if restore is not None:
+                vault_standarizer._restore_worker(*restore)
+
+    # Stop run(), once the notes being standarized are done
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+
+    # Notes waiting for their debounce or being standarized
+    def busy(self) -> bool:
+        return bool(self._pending or self._running)
+
+    # Pool of workers set up like vault_standarizer's. In this process, what was set up is put back afterwards
+    def _executor(self, filename_index) -> Tuple[Executor, Optional[tuple]]:
+        worker_setup = (None, False, filename_index)
+
+        if self.workers == 1:
+            import link_standarizer
+
+            restore = (link_standarizer._link_cache, link_standarizer._instrumentation is not None,
+                       vault_standarizer._filename_index)
+            vault_standarizer._init_worker(*worker_setup)
+            return ThreadPoolExecutor(1), restore
+
+        return ProcessPoolExecutor(self.workers, initializer=vault_standarizer._init_worker,
+                                   initargs=worker_setup), None
+
+    # Size and mtime of every note in the vault
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+
+        for path in vault_standarizer.iter_markdown_files(self.vault):
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Deleted since it was listed
+                continue
+            snapshot[path] = (st.st_size, st.st_mtime_ns)
+
+        return snapshot
+
+    # Queue the notes that changed since the last scan. Notes being standarized are looked at when they're done
+    def _queue_changes(self, snapshot: Dict[str, Tuple[int, int]], now: float):
+        for path, stat in snapshot.items():
+            if path not in self._running and self._snapshot.get(path) != stat:
+                self._snapshot[path] = stat
+                self._pending[path] = now
+
+        for path in set(self._snapshot) - set(snapshot):
+            if path not in self._running:
+                del self._snapshot[path]
+                self._pending.pop(path, None)
+
+    # Start the notes left alone for the debounce time
+    def _start_jobs(self, executor: Executor, now: float):
+        for path, changed in list(self._pending.items()):
+            if now - changed >= self.debounce and path not in self._running:
+                del self._pending[path]
+                self._running[path] = asyncio.ensure_future(self._standarize(executor, path))
+
+    async def _standarize(self, executor: Executor, path: str):
+        loop = asyncio.get_running_loop()
+
+        try:
+            result = await loop.run_in_executor(executor, vault_standarizer._standarize_job, (path, None))
+        finally:
+            del self._running[path]
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._snapshot.pop(path, None)
+        else:
+            stat = (st.st_size, st.st_mtime_ns)
+            self._snapshot[path] = stat
+
+            # Saved again while it was standarized, not by us
+            if result.error is None and stat != (result.size, result.mtime_ns):
+                self._pending[path] = loop.time()
+
+        if self.on_result is not None:
+            self.on_result(result)
+
+
+# Watch a vault until interrupted, printing every note standarized
+def watch_vault(vault: str, interval: float = 1.0, debounce: float = 2.0, workers: Optional[int] = 1,
+                resolve_wikilinks: bool = False, verbose: bool = True):
+    def report(result: FileResult):
+        if result.error is not None:
+            print(f"{result.path}: {result.error}", file=sys.stderr, flush=True)
+        elif result.links_changed and verbose:
+            print(f"{result.path}: {result.links_changed} links changed", flush=True)
+
+    watcher = VaultWatcher(vault, interval, debounce, workers, resolve_wikilinks, on_result=report)
+
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        pass